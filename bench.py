@@ -0,0 +1,443 @@
+"""Benchmarks for the fetch -> parse -> index -> probe -> rank -> render pipeline.
+
+Everything runs against local stand-ins: synthetic subscriptions (mixed
+vmess/vless/trojan/ss, plain and base64) are served by a local aiohttp server
+in place of SOURCES, and every config points at a local TCP listener with its
+own accept delay, a share of which never answer. The kernel completes the TCP
+handshake before the listener sees the connection, so the delay is applied to
+the first byte and harness probes time connect + first byte.
+
+    python bench.py --lines 10000,50000,200000 --listeners 1000 --drop-rate 0.2
+    python bench.py --lines 50000 --compare bench_results/20261018-120000.json
+
+Each run is saved as JSON under --out so later runs can be compared with it.
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Iterator, List, Optional, Sequence
+
+from aiohttp import web
+
+from config_index import ConfigIndex, ConfigRecord
+from fake_telegram import percentile
+from geoip import CountryClassifier
+from latency import LatencyCache
+from ranking import StreamingRanker
+from scheduler import BULK, ProbeScheduler
+from settings import COUNTRIES
+from sources import CHUNK_SIZE, SourceFetcher
+from subparser import SubscriptionParser
+
+MB = 1024 * 1024
+
+
+@dataclass
+class StageResult:
+    name: str
+    items: int = 0
+    seconds: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    rss_peak_mb: float = 0.0
+    alloc_peak_mb: Optional[float] = None
+    extra: dict = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        # Stages timed only as a whole have no percentiles.
+        def ms(q: float) -> Optional[float]:
+            return round(percentile(self.latencies, q) * 1000, 3) if self.latencies else None
+
+        return {
+            "name": self.name,
+            "items": self.items,
+            "seconds": round(self.seconds, 4),
+            "per_s": round(self.items / self.seconds, 1) if self.seconds else 0.0,
+            "p50_ms": ms(0.5),
+            "p95_ms": ms(0.95),
+            "p99_ms": ms(0.99),
+            "rss_peak_mb": round(self.rss_peak_mb, 1),
+            "alloc_peak_mb": round(self.alloc_peak_mb, 1) if self.alloc_peak_mb is not None else None,
+            **self.extra,
+        }
+
+
+class StageTimer:
+    """Times stages and records peak memory: process RSS high-water mark, and
+    with ``trace_memory`` the tracemalloc peak within the stage (slower)."""
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.results: List[StageResult] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[StageResult]:
+        result = StageResult(name)
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        yield result
+        result.seconds = time.perf_counter() - started
+        result.rss_peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if self.trace_memory:
+            result.alloc_peak_mb = tracemalloc.get_traced_memory()[1] / MB
+        self.results.append(result)
+        print(f"  {name:<14} {result.items:>8} items  {result.seconds:8.3f}s", flush=True)
+
+
+def flag(country: str) -> str:
+    return "".join(chr(0x1F1E6 + ord(c) - ord("a")) for c in country)
+
+
+def synthetic_configs(count: int, endpoints: Sequence[tuple[str, int]], seed: int = 1) -> list[str]:
+    """``count`` subscription lines spread over ``endpoints``; every 20th line repeats an earlier one."""
+    rnd = random.Random(seed)
+    lines: list[str] = []
+    for i in range(count):
+        if i % 20 == 19:
+            lines.append(lines[rnd.randrange(len(lines))])
+            continue
+        host, port = endpoints[rnd.randrange(len(endpoints))]
+        country = COUNTRIES[i % len(COUNTRIES)]
+        remark = f"{flag(country)} {country.upper()}-{i}" if i % 3 else f"node-{i}"
+        secret = f"{rnd.getrandbits(128):032x}"
+        uuid = f"{secret[:8]}-{secret[8:12]}-{secret[12:16]}-{secret[16:20]}-{secret[20:]}"
+        kind = i % 4
+        if kind == 0:
+            body = json.dumps({"v": "2", "ps": remark, "add": host, "port": str(port), "id": uuid, "net": "ws", "tls": "tls"})
+            lines.append("vmess://" + base64.b64encode(body.encode()).decode())
+        elif kind == 1:
+            lines.append(f"vless://{uuid}@{host}:{port}?encryption=none&security=tls&type=ws&path=%2F#{remark}")
+        elif kind == 2:
+            lines.append(f"trojan://{secret}@{host}:{port}?security=tls&sni=example.com#{remark}")
+        else:
+            userinfo = base64.urlsafe_b64encode(f"chacha20-ietf-poly1305:{secret}".encode()).decode().rstrip("=")
+            lines.append(f"ss://{userinfo}@{host}:{port}#{remark}")
+    return lines
+
+
+def subscription_bodies(lines: Sequence[str], sources: int) -> list[bytes]:
+    """Splits ``lines`` over ``sources`` bodies; every other one is a base64 subscription."""
+    bodies = []
+    for i in range(sources):
+        text = "\n".join(lines[i::sources]).encode()
+        bodies.append(base64.b64encode(text) if i % 2 else text)
+    return bodies
+
+
+class SourceServer:
+    """Serves subscription bodies at ``/sub/<n>`` with ETags, like a raw file host."""
+
+    def __init__(self, bodies: Sequence[bytes]):
+        self.bodies = list(bodies)
+        self.etags = [f'"{hash(body) & 0xFFFFFFFF:x}"' for body in self.bodies]
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        n = int(request.match_info["n"])
+        if request.headers.get("If-None-Match") == self.etags[n]:
+            return web.Response(status=304)
+        response = web.StreamResponse(headers={"ETag": self.etags[n], "Content-Type": "text/plain"})
+        await response.prepare(request)
+        body = self.bodies[n]
+        for start in range(0, len(body), CHUNK_SIZE):
+            await response.write(body[start:start + CHUNK_SIZE])
+        await response.write_eof()
+        return response
+
+    async def start(self) -> list[str]:
+        app = web.Application()
+        app.router.add_get("/sub/{n}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return [f"http://127.0.0.1:{self.port}/sub/{n}" for n in range(len(self.bodies))]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class FakeServers:
+    """Local TCP listeners standing in for proxy servers.
+
+    Each listener gets an accept delay drawn from ``delay_ms`` (±10% jitter
+    per connection); a ``drop_rate`` share of them accept but never answer.
+    """
+
+    def __init__(self, count: int, delay_ms: tuple[float, float] = (5, 200), drop_rate: float = 0.1, seed: int = 1):
+        self.count = count
+        self.delay_ms = delay_ms
+        self.drop_rate = drop_rate
+        self._rnd = random.Random(seed)
+        self._servers: list[asyncio.AbstractServer] = []
+        self._writers: set[asyncio.StreamWriter] = set()
+        self.endpoints: list[tuple[str, int]] = []
+        self.connections = 0
+
+    async def start(self) -> list[tuple[str, int]]:
+        for _ in range(self.count):
+            delay = self._rnd.uniform(*self.delay_ms) / 1000
+            dropped = self._rnd.random() < self.drop_rate
+            server = await asyncio.start_server(partial(self._handle, delay, dropped), "127.0.0.1", 0)
+            self._servers.append(server)
+            self.endpoints.append(("127.0.0.1", server.sockets[0].getsockname()[1]))
+        return self.endpoints
+
+    async def _handle(self, delay: float, dropped: bool, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            if dropped:
+                await reader.read()
+            else:
+                await asyncio.sleep(delay * random.uniform(0.9, 1.1))
+                writer.write(b"\0")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def stop(self) -> None:
+        for server in self._servers:
+            server.close()
+        for writer in list(self._writers):
+            writer.transport.abort()
+        await asyncio.sleep(0.1)
+        await asyncio.gather(*(server.wait_closed() for server in self._servers), return_exceptions=True)
+
+
+async def first_byte_ping(host: str, port: int, timeout: float = 1.0) -> float | None:
+    started = time.perf_counter()
+    try:
+        async with asyncio.timeout(timeout):
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                data = await reader.read(1)
+            finally:
+                writer.close()
+    except (OSError, TimeoutError):
+        return None
+    return (time.perf_counter() - started) * 1000 if data else None
+
+
+def load_bot_module():
+    """The bot module for the render stage; importing it needs BOT_TOKEN."""
+    try:
+        import main
+    except Exception as e:
+        print(f"Стадия render пропущена: main не импортируется ({e})")
+        return None
+    return main
+
+
+def render_stage(main, result: StageResult, ranked: Sequence[ConfigRecord], values: dict, max_pages: int) -> None:
+    """Renders list pages with the bot's own keyboard code."""
+    pages = min(max_pages, (len(ranked) + main.ITEMS_PER_PAGE - 1) // main.ITEMS_PER_PAGE)
+    for page in range(pages):
+        started = time.perf_counter()
+        records = main.page_cache.page_records(ranked, page)
+        pings = [main.format_ping(values.get(rec.address)) for rec in records]
+        main.render_config_list_keyboard(ranked, page, pings)
+        result.latencies.append(time.perf_counter() - started)
+    result.items = pages
+
+
+async def run_size(lines_count: int, args: argparse.Namespace, servers: FakeServers, bot_module) -> list[dict]:
+    timer = StageTimer(args.trace_memory)
+    print(f"{lines_count} lines, {args.sources} sources, {servers.count} endpoints")
+
+    with timer.stage("generate") as st:
+        lines = synthetic_configs(lines_count, servers.endpoints, args.seed)
+        bodies = subscription_bodies(lines, args.sources)
+        st.items = len(lines)
+        st.extra["bytes"] = sum(map(len, bodies))
+
+    with timer.stage("parse") as st:
+        parsed = 0
+        for body in bodies:
+            started = time.perf_counter()
+            parser = SubscriptionParser()
+            for start in range(0, len(body), CHUNK_SIZE):
+                parsed += sum(1 for _ in parser.feed(body[start:start + CHUNK_SIZE]))
+            parsed += sum(1 for _ in parser.close())
+            st.latencies.append(time.perf_counter() - started)
+        st.items = parsed
+
+    source_server = SourceServer(bodies)
+    urls = await source_server.start()
+    try:
+        fetcher = SourceFetcher(urls, timeout=60)
+        with timer.stage("fetch") as st:
+            report = await fetcher.refresh()
+            st.items = len(fetcher.merged())
+            st.latencies = [state.last_duration for state in fetcher.states.values()]
+            st.extra["failed"] = len(report.failed)
+            st.extra["bytes"] = report.bytes
+        with timer.stage("refetch_304") as st:
+            await fetcher.refresh()
+            st.items = len(urls)
+            st.latencies = [state.last_duration for state in fetcher.states.values()]
+    finally:
+        await source_server.stop()
+
+    configs = fetcher.merged()
+    classifier = CountryClassifier(None, hints=COUNTRIES)
+    with timer.stage("index") as st:
+        started = time.perf_counter()
+        index = ConfigIndex.build(configs, COUNTRIES, None, classifier)
+        st.latencies.append(time.perf_counter() - started)
+        st.items = len(configs)
+        st.extra["records"] = len(index)
+    with timer.stage("index_rebuild") as st:
+        for _ in range(args.index_rebuilds):
+            started = time.perf_counter()
+            index = ConfigIndex.build(configs, COUNTRIES, index, classifier)
+            st.latencies.append(time.perf_counter() - started)
+        st.items = len(configs) * args.index_rebuilds
+
+    endpoints = sorted({rec.address for rec in index.records if rec.address})
+    values: dict = {}
+    with timer.stage("probe") as st:
+        scheduler = ProbeScheduler(args.probe_concurrency, probe=partial(first_byte_ping, timeout=args.probe_timeout))
+        cache = LatencyCache(ttl=600, max_size=len(endpoints) + 1, probe=scheduler.submit, promote=scheduler.promote)
+
+        async def probe(endpoint: tuple[str, int]) -> None:
+            started = time.perf_counter()
+            values[endpoint] = await cache.get(*endpoint, owner="bench", priority=BULK)
+            st.latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(probe(ep) for ep in endpoints))
+        st.items = len(endpoints)
+        st.extra["reachable"] = sum(v is not None for v in values.values())
+
+    with timer.stage("rank_top") as st:
+        scheduler = ProbeScheduler(args.probe_concurrency, probe=partial(first_byte_ping, timeout=args.probe_timeout))
+        cache = LatencyCache(ttl=600, max_size=len(endpoints) + 1, probe=scheduler.submit, promote=scheduler.promote)
+        started = time.perf_counter()
+        first_update: list[float] = []
+
+        async def on_update(_: StreamingRanker) -> None:
+            if not first_update:
+                first_update.append(time.perf_counter() - started)
+
+        async def rank_probe(rec: ConfigRecord) -> float | None:
+            return await cache.get(*rec.address, owner="bench", priority=BULK) if rec.address else None
+
+        ranker = StreamingRanker(rank_probe, k=args.top, confident_ms=args.confident_ms, first_deadline=0.5, on_update=on_update)
+        top = await ranker.run(index.records)
+        st.items = len(index.records)
+        st.extra["top"] = len(top)
+        st.extra["stopped_early"] = ranker.stopped_early
+        st.extra["first_update_s"] = round(first_update[0], 3) if first_update else None
+
+    if bot_module is not None:
+        ranked = sorted(index.records, key=lambda rec: values.get(rec.address) or float("inf"))
+        with timer.stage("render") as st:
+            render_stage(bot_module, st, ranked, values, args.max_pages)
+
+    return [r.as_dict() for r in timer.results]
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value:>9.2f}" if value is not None else f"{'-':>9}"
+
+
+def compare(current: dict, previous_path: str) -> None:
+    with open(previous_path, encoding="utf-8") as f:
+        previous = json.load(f)
+    old = {(run["lines"], s["name"]): s for run in previous["runs"] for s in run["stages"]}
+    print(f"\nСравнение с {previous_path}:")
+    matched = 0
+    for run in current["runs"]:
+        for s in run["stages"]:
+            before = old.get((run["lines"], s["name"]))
+            if before is None or not before["seconds"]:
+                continue
+            matched += 1
+            change = (s["seconds"] - before["seconds"]) / before["seconds"] * 100
+            mark = "  <-- медленнее" if change > 10 else ""
+            print(
+                f"  {run['lines']:>7} {s['name']:<14} {before['seconds']:8.3f}s -> {s['seconds']:8.3f}s "
+                f"({change:+.1f}%), p95 {before['p95_ms']} -> {s['p95_ms']}ms, "
+                f"rss {before['rss_peak_mb']} -> {s['rss_peak_mb']}MB{mark}"
+            )
+    if not matched:
+        print("  нет прогонов с тем же числом строк")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", default="10000,50000", help="comma-separated subscription sizes")
+    parser.add_argument("--sources", type=int, default=8)
+    parser.add_argument("--listeners", type=int, default=500)
+    parser.add_argument("--delay-ms", default="5,200", help="accept delay range of the listeners")
+    parser.add_argument("--drop-rate", type=float, default=0.1)
+    parser.add_argument("--probe-concurrency", type=int, default=200)
+    parser.add_argument("--probe-timeout", type=float, default=1.0)
+    parser.add_argument("--index-rebuilds", type=int, default=5, help="timed incremental index rebuilds")
+    parser.add_argument("--top", type=int, default=50)
+    parser.add_argument("--confident-ms", type=float, default=300)
+    parser.add_argument("--max-pages", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace-memory", action="store_true", help="tracemalloc peak per stage (slower)")
+    parser.add_argument("--out", default="bench_results")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    if args.trace_memory:
+        tracemalloc.start()
+    low, high = (float(v) for v in args.delay_ms.split(","))
+    bot_module = load_bot_module()
+    servers = FakeServers(args.listeners, (low, high), args.drop_rate, args.seed)
+    await servers.start()
+    result = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        "runs": [],
+    }
+    try:
+        for size in (int(v) for v in args.lines.split(",")):
+            result["runs"].append({"lines": size, "stages": await run_size(size, args, servers, bot_module)})
+    finally:
+        await servers.stop()
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    for run in result["runs"]:
+        print(f"\n{run['lines']} lines")
+        print(f"  {'stage':<14} {'items':>8} {'s':>8} {'per_s':>10} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} {'rss_mb':>7}")
+        for s in run["stages"]:
+            print(
+                f"  {s['name']:<14} {s['items']:>8} {s['seconds']:>8.3f} {s['per_s']:>10.1f} "
+                f"{_ms(s['p50_ms'])} {_ms(s['p95_ms'])} {_ms(s['p99_ms'])} {s['rss_peak_mb']:>7.1f}"
+            )
+    print(f"\nРезультаты сохранены в {path}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
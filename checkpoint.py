@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+from config_index import ConfigIndex, ConfigRecord
+from config_pool import ConfigPool
+from latency import LatencyCache
+from prober import HealthProber
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE sources (
+    url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT,
+    configs BLOB, last_fetch_at REAL, last_change_at REAL
+);
+CREATE TABLE records (
+    offset INTEGER PRIMARY KEY, protocol TEXT, host TEXT, port INTEGER,
+    remark TEXT, fingerprint INTEGER, raw TEXT
+);
+CREATE TABLE endpoints (
+    host TEXT, port INTEGER, ewma REAL, jitter REAL, last_ok REAL, probes INTEGER,
+    failures INTEGER, last_value REAL, samples BLOB, pos INTEGER, count INTEGER, age REAL,
+    PRIMARY KEY (host, port)
+);
+CREATE TABLE latencies (host TEXT, port INTEGER, age REAL, value REAL, PRIMARY KEY (host, port));
+"""
+
+
+def _signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+@dataclass
+class State:
+    saved_at: float
+    refreshed_at: float
+    pool_version: int
+    sources: list[tuple]
+    records: Optional[list[ConfigRecord]]
+    endpoints: list[tuple]
+    latencies: list[tuple]
+
+
+class Checkpointer:
+    """Periodic SQLite checkpoint of the pool, its sources and the latency data.
+
+    A checkpoint is written to a temporary file in a worker thread and then
+    atomically renamed over ``path``, so a crash mid-write leaves the previous
+    one intact. Between snapshots only the probe statistics and latencies
+    change, so those saves rewrite just their two tables in place instead of
+    the whole file. ``restore`` loads it at startup: the parsed index is published
+    as-is, sources keep their validators (the first refresh is conditional),
+    and probe statistics are aged by the downtime.
+
+    Worker processes use ``follow`` instead: it re-reads the file whenever it
+    changes, replacing the snapshot only when the writer published a new one
+    and merging in probe statistics and latencies.
+    """
+
+    def __init__(self, path: str, pool: ConfigPool, prober: HealthProber, cache: LatencyCache, interval: float):
+        self.path = path
+        self.pool = pool
+        self.prober = prober
+        self.cache = cache
+        self.interval = interval
+        self._saved_version: Optional[int] = None
+        self._saved_probes: Optional[tuple] = None
+        self._synced_mtime: Optional[int] = None
+        self._write_lock = asyncio.Lock()
+        self._synced_version: Optional[int] = None
+        self.saves = 0
+        self.last_save_ms = 0.0
+        self.last_size = 0
+
+    async def restore(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        started = time.monotonic()
+        try:
+            state = await asyncio.to_thread(self._read)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать сохранённое состояние {self.path}: {e}")
+            return False
+        if state is None:
+            return False
+        await self._apply(state)
+        logger.info(
+            f"Состояние восстановлено за {(time.monotonic() - started) * 1000:.0f}ms: "
+            f"{len(state.records)} конфигов, {len(state.endpoints)} эндпоинтов, {len(state.latencies)} пингов "
+            f"(сохранено {time.time() - state.saved_at:.0f}s назад)"
+        )
+        return True
+
+    async def sync(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._synced_mtime:
+            return False
+        state = await asyncio.to_thread(self._read, self._synced_version)
+        if state is None:
+            return False
+        self._synced_mtime = mtime
+        await self._apply(state, replace=True)
+        return True
+
+    async def follow(self, interval: float) -> None:
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Ошибка чтения общего состояния: {e}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    async def _apply(self, state: State, replace: bool = False) -> None:
+        downtime = max(0.0, time.time() - state.saved_at)
+        fetcher = self.pool.fetcher
+        for url, etag, last_modified, content_hash, configs, last_fetch_at, last_change_at in state.sources:
+            source = fetcher.states.get(url)
+            if source is None:
+                continue
+            source.etag = etag
+            source.last_modified = last_modified
+            source.content_hash = content_hash
+            source.configs = tuple(zlib.decompress(configs).decode("utf-8").split("\n")) if configs else ()
+            source.last_fetch_at = last_fetch_at
+            source.last_change_at = last_change_at
+        if state.records is not None:
+            index = await asyncio.to_thread(ConfigIndex, state.records, self.pool.countries, self.pool.classify)
+            self.pool.restore(index, state.refreshed_at, replace=replace)
+            self._synced_version = state.pool_version
+        self.prober.load((*row[:-1], row[-1] + downtime) for row in state.endpoints)
+        self.cache.load((host, port, age + downtime, value) for host, port, age, value in state.latencies)
+
+    def _read(self, known_version: Optional[int] = None) -> Optional[State]:
+        conn = sqlite3.connect(self.path)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if meta.get("schema") != SCHEMA_VERSION:
+                return None
+            pool_version = meta.get("pool_version", 0)
+            if known_version is not None and pool_version == known_version:
+                return State(
+                    saved_at=meta["saved_at"],
+                    refreshed_at=meta["refreshed_at"],
+                    pool_version=pool_version,
+                    sources=[],
+                    records=None,
+                    endpoints=conn.execute("SELECT * FROM endpoints").fetchall(),
+                    latencies=conn.execute("SELECT * FROM latencies").fetchall(),
+                )
+            records = [
+                ConfigRecord(protocol, host, port, remark, _unsigned(fp), offset, raw)
+                for offset, protocol, host, port, remark, fp, raw in conn.execute(
+                    "SELECT offset, protocol, host, port, remark, fingerprint, raw FROM records ORDER BY offset"
+                )
+            ]
+            return State(
+                saved_at=meta["saved_at"],
+                refreshed_at=meta["refreshed_at"],
+                pool_version=pool_version,
+                sources=conn.execute("SELECT * FROM sources").fetchall(),
+                records=records,
+                endpoints=conn.execute("SELECT * FROM endpoints").fetchall(),
+                latencies=conn.execute("SELECT * FROM latencies").fetchall(),
+            )
+        finally:
+            conn.close()
+
+    async def save(self, force: bool = False) -> bool:
+        async with self._write_lock:
+            return await self._save(force)
+
+    async def _save(self, force: bool) -> bool:
+        snapshot = self.pool.snapshot
+        if snapshot is None:
+            return False
+        full = force or snapshot.version != self._saved_version or not os.path.exists(self.path)
+        probes = (self.prober.probes, len(self.cache))
+        if not full and probes == self._saved_probes:
+            return False
+        started = time.monotonic()
+        state = State(
+            saved_at=time.time(),
+            refreshed_at=self.pool.refreshed_at or snapshot.created_at,
+            pool_version=snapshot.version,
+            sources=[
+                (s.url, s.etag, s.last_modified, s.content_hash, s.configs, s.last_fetch_at, s.last_change_at)
+                for s in self.pool.fetcher.states.values()
+            ] if full else [],
+            records=list(snapshot.records) if full else None,
+            endpoints=self.prober.dump(),
+            latencies=self.cache.dump(),
+        )
+        await asyncio.to_thread(self._write if full else self._write_probes, state)
+        self._saved_version = snapshot.version
+        self._saved_probes = probes
+        self.saves += 1
+        self.last_save_ms = round((time.monotonic() - started) * 1000, 1)
+        self.last_size = os.path.getsize(self.path)
+        logger.info(f"Состояние сохранено: {self.last_size / 1024:.0f} KB за {self.last_save_ms:.0f}ms")
+        return True
+
+    def _write(self, state: State) -> None:
+        tmp = f"{self.path}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.executescript(SCHEMA)
+            with conn:
+                conn.executemany(
+                    "INSERT INTO meta VALUES (?, ?)",
+                    [
+                        ("schema", SCHEMA_VERSION),
+                        ("saved_at", state.saved_at),
+                        ("refreshed_at", state.refreshed_at),
+                        ("pool_version", state.pool_version),
+                    ],
+                )
+                conn.executemany(
+                    "INSERT INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (url, etag, lm, h, zlib.compress("\n".join(configs).encode("utf-8")) if configs else None, f, c)
+                        for url, etag, lm, h, configs, f, c in state.sources
+                    ],
+                )
+                conn.executemany(
+                    "INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (r.offset, r.protocol, r.host, r.port, r.remark, _signed(r.fingerprint), r.raw)
+                        for r in state.records
+                    ],
+                )
+                conn.executemany("INSERT OR REPLACE INTO endpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", state.endpoints)
+                conn.executemany("INSERT OR REPLACE INTO latencies VALUES (?, ?, ?, ?)", state.latencies)
+        finally:
+            conn.close()
+        os.replace(tmp, self.path)
+
+    def _write_probes(self, state: State) -> None:
+        # One transaction, so readers see either the old or the new statistics.
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                    [("saved_at", state.saved_at), ("refreshed_at", state.refreshed_at)],
+                )
+                conn.execute("DELETE FROM endpoints")
+                conn.execute("DELETE FROM latencies")
+                conn.executemany("INSERT OR REPLACE INTO endpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", state.endpoints)
+                conn.executemany("INSERT OR REPLACE INTO latencies VALUES (?, ?, ?, ?)", state.latencies)
+        finally:
+            conn.close()
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.error(f"Ошибка сохранения состояния: {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {"saves": self.saves, "last_save_ms": self.last_save_ms, "bytes": self.last_size}
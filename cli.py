@@ -0,0 +1,253 @@
+"""Headless sweep: fetch every source, parse and deduplicate, probe, write ranked exports.
+
+Runs the bot's pipeline without Telegram (neither aiogram nor BOT_TOKEN is
+needed), e.g. from cron to publish ranked lists or as a profiling target.
+
+    python cli.py --out out --formats txt,clash --top 200
+    python cli.py --protocol vless --country de --max-ms 300 --concurrency 500
+    python cli.py --sources urls.txt --limit 20000 --processes 4
+
+Files are named like the bot's exports (configs_<label>.<ext>); a timing
+breakdown per stage is printed at the end.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from config_index import ConfigIndex, ConfigRecord
+from exports import FORMAT_EXTENSIONS, FORMATS, RENDERERS
+from geoip import CountryClassifier
+from latency import Endpoint, endpoint_key, measure_tcp_ping
+from resolver import DnsCache
+from settings import (
+    COUNTRIES,
+    DNS_CACHE_TTL,
+    DNS_NEGATIVE_TTL,
+    GEOIP_DB,
+    MAX_INFLIGHT_PROBES,
+    PROBE_POOL_CONCURRENCY,
+    PROBE_POOL_RATE,
+    PROBE_PROCESSES,
+    PROBE_TIMEOUT,
+    SOURCES,
+)
+from sources import SourceFetcher
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    name: str
+    seconds: float = 0.0
+    items: int = 0
+    note: str = ""
+
+
+@dataclass
+class Timings:
+    stages: List[Stage] = field(default_factory=list)
+    details: List[str] = field(default_factory=list)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        stage = Stage(name)
+        started = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - started
+            self.stages.append(stage)
+
+    def print(self, file=sys.stderr) -> None:
+        total = sum(s.seconds for s in self.stages)
+        print(f"{'stage':<10} {'s':>8} {'share':>6} {'items':>8} {'per_s':>10}  note", file=file)
+        for s in self.stages:
+            share = s.seconds / total if total else 0.0
+            rate = s.items / s.seconds if s.seconds else 0.0
+            print(f"{s.name:<10} {s.seconds:>8.3f} {share:>6.1%} {s.items:>8} {rate:>10.1f}  {s.note}", file=file)
+        print(f"{'total':<10} {total:>8.3f}", file=file)
+        for line in self.details:
+            print(line, file=file)
+
+
+def read_sources(path: Optional[str]) -> List[str]:
+    if path is None:
+        return list(SOURCES)
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+async def probe_endpoints(
+    endpoints: Sequence[Endpoint],
+    concurrency: int,
+    timeout: float,
+    resolver: DnsCache,
+) -> Dict[Endpoint, Optional[float]]:
+    """Probes with ``concurrency`` workers sharing one iterator, so the task count stays fixed.
+
+    A probe that raises counts as unreachable instead of ending the run.
+    """
+    results: Dict[Endpoint, Optional[float]] = {}
+    remaining = iter(endpoints)
+
+    async def worker() -> None:
+        for host, port in remaining:
+            try:
+                results[(host, port)] = await measure_tcp_ping(host, port, timeout, resolver)
+            except Exception as e:
+                logger.warning(f"Проверка {host}:{port} завершилась ошибкой: {e!r}")
+                results[(host, port)] = None
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(endpoints))))))
+    return results
+
+
+async def sweep_endpoints(
+    endpoints: Sequence[Endpoint],
+    args: argparse.Namespace,
+    timings: Timings,
+) -> Dict[Endpoint, Optional[float]]:
+    from probe_pool import ProbePool
+
+    pool = ProbePool(args.processes, concurrency=args.concurrency, rate=args.rate or None, timeout=args.timeout)
+    results: Dict[Endpoint, Optional[float]] = {}
+    try:
+        async for batch in pool.sweep(list(endpoints)):
+            for host, port, value in batch:
+                results[(host, port)] = value
+        for core in pool.stats()["per_core"]:
+            timings.details.append(
+                f"процесс #{core['index']}: {core['probes']} проверок, {core['probes_per_s']} в секунду, "
+                f"CPU {core['cpu_s']}s ({core['cpu_util']:.0%} занятого времени)"
+            )
+    finally:
+        await pool.close()
+    return results
+
+
+def write_exports(records: Sequence[ConfigRecord], formats: Sequence[str], out: str, label: str) -> List[str]:
+    os.makedirs(out, exist_ok=True)
+    written = []
+    for fmt in formats:
+        # txt and b64 share an extension.
+        suffix = "_b64" if fmt == "b64" else ""
+        path = os.path.join(out, f"configs_{label}{suffix}.{FORMAT_EXTENSIONS[fmt]}")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(RENDERERS[fmt](records))
+        os.replace(tmp, path)
+        written.append(path)
+    return written
+
+
+async def run(args: argparse.Namespace) -> int:
+    timings = Timings()
+    formats = [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in RENDERERS]
+    if unknown:
+        raise SystemExit(f"Неизвестные форматы: {', '.join(unknown)} (доступны: {', '.join(FORMATS)})")
+
+    with timings.stage("fetch") as st:
+        fetcher = SourceFetcher(read_sources(args.sources), timeout=args.fetch_timeout)
+        report = await fetcher.refresh()
+        configs = fetcher.merged()
+        st.items = len(configs)
+        st.note = report.summary()
+    if not configs:
+        logger.error("Ни один источник не вернул конфиги")
+        timings.print()
+        return 1
+
+    resolver = DnsCache(ttl=DNS_CACHE_TTL, negative_ttl=DNS_NEGATIVE_TTL, concurrency=args.dns_concurrency)
+    classifier = CountryClassifier(args.geoip, resolver=resolver, hints=COUNTRIES)
+    countries = tuple(dict.fromkeys(COUNTRIES + ((args.country.lower(),) if args.country else ())))
+    with timings.stage("index") as st:
+        index = ConfigIndex.build(configs, countries, None, classifier)
+        st.items = len(configs)
+        st.note = f"уникальных {len(index)}"
+
+    if args.country and classifier.table is not None:
+        # GeoIP only knows resolved hosts: resolve everything once, then classify again.
+        with timings.stage("geoip_dns") as st:
+            hosts = {rec.host for rec in index.records if rec.host}
+            await resolver.prefetch(hosts)
+            st.items = len(hosts)
+        with timings.stage("classify") as st:
+            index = ConfigIndex(index.records, countries, classifier)
+            st.items = len(index)
+
+    selected = index.select(args.protocol, args.country)
+    if args.limit:
+        selected = selected[:args.limit]
+    # Same key as the bot's probe path: IPv6 hosts lose their brackets.
+    endpoints = list(dict.fromkeys(endpoint_key(*rec.address) for rec in selected if rec.address))
+    if not args.processes:
+        with timings.stage("resolve") as st:
+            hosts = {host for host, _ in endpoints}
+            await resolver.prefetch(hosts)
+            st.items = len(hosts)
+            st.note = f"ошибок {resolver.stats()['failures']}"
+
+    with timings.stage("probe") as st:
+        if args.processes:
+            values = await sweep_endpoints(endpoints, args, timings)
+            st.note = f"процессов {args.processes}, "
+        else:
+            values = await probe_endpoints(endpoints, args.concurrency, args.timeout, resolver)
+        st.items = len(endpoints)
+        st.note += f"доступно {sum(v is not None for v in values.values())}"
+
+    with timings.stage("rank") as st:
+        scored = [
+            (value, rec) for rec in selected
+            if rec.address and (value := values.get(endpoint_key(*rec.address))) is not None and (args.max_ms is None or value <= args.max_ms)
+        ]
+        scored.sort(key=lambda item: item[0])
+        ranked = [rec for _, rec in scored[:args.top or None]]
+        st.items = len(selected)
+        st.note = f"в выдаче {len(ranked)}"
+
+    label = "_".join(part for part in ("fastest", args.protocol, args.country) if part)
+    with timings.stage("export") as st:
+        written = write_exports(ranked, formats, args.out, label)
+        st.items = len(ranked) * len(written)
+        st.note = ", ".join(written)
+
+    timings.print()
+    return 0 if ranked else 1
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sources", help="file with subscription URLs, one per line (default: the bot's SOURCES)")
+    parser.add_argument("--out", default="out", help="directory for the export files")
+    parser.add_argument("--formats", default=",".join(FORMATS), help=f"comma-separated, of {', '.join(FORMATS)}")
+    parser.add_argument("--protocol", help="only this protocol (vless, vmess, trojan, ss, ...)")
+    parser.add_argument("--country", help="only this country code")
+    parser.add_argument("--limit", type=int, default=0, help="probe at most this many configs (0 = all)")
+    parser.add_argument("--top", type=int, default=0, help="export at most this many fastest configs (0 = all reachable)")
+    parser.add_argument("--max-ms", type=float, help="drop configs slower than this")
+    parser.add_argument("--concurrency", type=int, help="probes in flight (per process with --processes)")
+    parser.add_argument("--processes", type=int, default=PROBE_PROCESSES, help="probe processes (0 = probe in-process)")
+    parser.add_argument("--rate", type=float, default=PROBE_POOL_RATE, help="probes per second across processes (0 = unpaced)")
+    parser.add_argument("--timeout", type=float, default=PROBE_TIMEOUT, help="probe timeout, s")
+    parser.add_argument("--fetch-timeout", type=float, default=15.0, help="per-source download timeout, s")
+    parser.add_argument("--dns-concurrency", type=int, default=64)
+    parser.add_argument("--geoip", default=GEOIP_DB, help="GeoIP range table used for --country")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    if args.concurrency is None:
+        args.concurrency = PROBE_POOL_CONCURRENCY if args.processes else MAX_INFLIGHT_PROBES
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+UPDATE_KINDS = (
+    "message",
+    "edited_message",
+    "callback_query",
+    "inline_query",
+    "chosen_inline_result",
+    "my_chat_member",
+    "chat_member",
+    "pre_checkout_query",
+    "shipping_query",
+)
+
+
+def update_user_id(update: dict) -> Optional[int]:
+    for kind in UPDATE_KINDS:
+        obj = update.get(kind)
+        if not obj:
+            continue
+        user = obj.get("from") or obj.get("chat")
+        if user and "id" in user:
+            return int(user["id"])
+    return None
+
+
+class Worker:
+    __slots__ = ("index", "port", "process", "restarts")
+
+    def __init__(self, index: int, port: int):
+        self.index = index
+        self.port = port
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+
+
+class Cluster:
+    """Front process that owns N update-handling worker processes.
+
+    Workers are copies of the bot started with ``BOT_ROLE=worker`` on local
+    ports; they read the snapshot and latency data the coordinator shares
+    through the checkpoint file. Every incoming update is forwarded to the
+    worker chosen by its user id, so a user's session and pagination state
+    always live in the same process. Crashed workers are restarted.
+    """
+
+    def __init__(self, workers: int, base_port: int, path: str, secret: Optional[str] = None, restart_delay: float = 1.0):
+        self.path = path
+        self.secret = secret
+        self.restart_delay = restart_delay
+        self.workers: List[Worker] = [Worker(i, base_port + i) for i in range(workers)]
+        self._round_robin = itertools.count()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._supervisors: List[asyncio.Task] = []
+        self._stopping = False
+        self.forwarded = [0] * workers
+        self.failed = 0
+
+    def worker_for(self, update: dict) -> Worker:
+        user_id = update_user_id(update)
+        if user_id is None:
+            return self.workers[next(self._round_robin) % len(self.workers)]
+        return self.workers[user_id % len(self.workers)]
+
+    async def start(self) -> None:
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        self._supervisors = [asyncio.create_task(self._supervise(worker)) for worker in self.workers]
+
+    async def _spawn(self, worker: Worker) -> None:
+        env = dict(
+            os.environ,
+            BOT_ROLE="worker",
+            BOT_MODE="webhook",
+            WORKER_INDEX=str(worker.index),
+            WEBHOOK_HOST="127.0.0.1",
+            PORT=str(worker.port),
+            WEBHOOK_PATH=self.path,
+        )
+        env.pop("WEBHOOK_URL", None)
+        env.pop("WEBHOOK_SECRET", None)
+        worker.process = await asyncio.create_subprocess_exec(sys.executable, sys.argv[0], env=env)
+        logger.info(f"Запущен воркер #{worker.index} (pid {worker.process.pid}, порт {worker.port})")
+
+    async def _supervise(self, worker: Worker) -> None:
+        while not self._stopping:
+            await self._spawn(worker)
+            code = await worker.process.wait()
+            if self._stopping:
+                return
+            worker.restarts += 1
+            logger.error(f"Воркер #{worker.index} завершился с кодом {code}, перезапуск")
+            await asyncio.sleep(self.restart_delay)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not secrets.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.secret
+        ):
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        worker = self.worker_for(update)
+        try:
+            async with self._session.post(
+                f"http://127.0.0.1:{worker.port}{self.path}",
+                data=body,
+                headers={"Content-Type": "application/json"},
+            ) as resp:
+                await resp.read()
+                status = resp.status
+        except Exception as e:
+            logger.warning(f"Воркер #{worker.index} недоступен: {e}")
+            status = 503
+        if status >= 400:
+            self.failed += 1
+            return web.Response(status=503)
+        self.forwarded[worker.index] += 1
+        return web.json_response({})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def stop(self, timeout: float = 15.0) -> None:
+        self._stopping = True
+        running = [w.process for w in self.workers if w.process is not None and w.process.returncode is None]
+        for process in running:
+            process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(p.wait() for p in running)), timeout)
+        except asyncio.TimeoutError:
+            for process in running:
+                if process.returncode is None:
+                    process.kill()
+        for task in self._supervisors:
+            task.cancel()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "workers": [
+                {
+                    "index": w.index,
+                    "pid": w.process.pid if w.process else None,
+                    "alive": w.process is not None and w.process.returncode is None,
+                    "restarts": w.restarts,
+                    "forwarded": self.forwarded[w.index],
+                }
+                for w in self.workers
+            ],
+            "failed": self.failed,
+        }
@@ -0,0 +1,213 @@
+import base64
+import hashlib
+import json
+import re
+from typing import Callable, Dict, Iterable, Optional, Sequence
+from urllib.parse import unquote
+
+
+def parse_server_address(config: str) -> tuple[str, int] | None:
+    """Endpoint of a config; ``None`` when there is none or its port is out of range."""
+    address = _server_address(config)
+    if address is None or not 0 < address[1] < 65536:
+        return None
+    return address
+
+
+def _server_address(config: str) -> tuple[str, int] | None:
+    if not config.startswith(("vmess://", "vless://", "trojan://", "ss://")):
+        return None
+    try:
+        encoded_part = config.split("://", 1)[1].split("#")[0].split("?")[0].strip()
+
+        if "@" in encoded_part:
+            encoded_part = encoded_part.split("@")[-1]
+
+        if ":" in encoded_part and encoded_part.count(":") >= 1:
+            host_port = encoded_part.rsplit(":", 1)
+            if host_port[1].isdigit():
+                return host_port[0].strip(), int(host_port[1])
+
+        decoded = base64.urlsafe_b64decode(encoded_part + "==" * 2).decode("utf-8", errors="ignore")
+        data = json.loads(decoded)
+
+        add = data.get("add") or data.get("address") or data.get("host")
+        port = data.get("port")
+
+        if add and port and isinstance(port, (int, str)) and str(port).isdigit():
+            return str(add).strip(), int(port)
+
+    except Exception:
+        pass
+
+    try:
+        if "://" in config:
+            after = config.split("://", 1)[1]
+            if ":" in after:
+                parts = after.rsplit(":", 1)
+                if len(parts) == 2 and parts[1].split("#")[0].strip().isdigit():
+                    return parts[0].strip(), int(parts[1].split("#")[0].strip())
+    except:
+        pass
+
+    return None
+
+
+_WORD_RE = re.compile("[a-z]+")
+
+
+def _decode_vmess(body: str) -> dict | None:
+    try:
+        decoded = base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)).decode("utf-8", errors="ignore")
+        data = json.loads(decoded)
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _normalize_host(host: str) -> str:
+    return host.strip().strip("[]").lower()
+
+
+def fingerprint(protocol: str, host: str, port: int, credentials: str) -> int:
+    key = f"{protocol}|{credentials}|{_normalize_host(host)}|{port}".encode("utf-8", errors="ignore")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+
+
+class ConfigRecord:
+    __slots__ = ("protocol", "host", "port", "remark", "fingerprint", "offset", "raw")
+
+    def __init__(self, protocol: str, host: str, port: int, remark: str, fingerprint: int, offset: int, raw: str):
+        self.protocol = protocol
+        self.host = host
+        self.port = port
+        self.remark = remark
+        self.fingerprint = fingerprint
+        self.offset = offset
+        self.raw = raw
+
+    @property
+    def address(self) -> tuple[str, int] | None:
+        return (self.host, self.port) if self.host and self.port else None
+
+    def __repr__(self) -> str:
+        return f"ConfigRecord({self.protocol}://{self.host}:{self.port} #{self.remark!r})"
+
+
+def parse_config(raw: str, offset: int = 0) -> ConfigRecord:
+    protocol, _, rest = raw.partition("://")
+    protocol = protocol.lower()
+    body, _, remark = rest.partition("#")
+    remark = unquote(remark).strip()
+    credentials = ""
+    data = _decode_vmess(body.split("?")[0].strip()) if protocol == "vmess" else None
+    if data is not None:
+        credentials = str(data.get("id", ""))
+        remark = remark or str(data.get("ps", "")).strip()
+    elif "@" in body:
+        credentials = unquote(body.split("?")[0].rsplit("@", 1)[0])
+    addr = parse_server_address(raw)
+    host, port = addr if addr else ("", 0)
+    if addr is None and not credentials:
+        credentials = body
+    return ConfigRecord(protocol, host, port, remark, fingerprint(protocol, host, port, credentials), offset, raw)
+
+
+class ConfigIndex:
+    """Parsed, deduplicated view of one snapshot.
+
+    Records are built once per snapshot; duplicates (same protocol, endpoint and
+    credentials) keep the first occurrence. ``by_protocol`` and ``by_country``
+    hold record offsets so filters cost O(result) instead of a full scan.
+    ``classify`` maps a record to a lower-case country code (see
+    geoip.CountryClassifier); without it records are only matched by the
+    ``countries`` codes appearing as words in their remarks.
+    """
+
+    def __init__(
+        self,
+        records: Sequence[ConfigRecord],
+        countries: Sequence[str] = (),
+        classify: Optional[Callable[[ConfigRecord], Optional[str]]] = None,
+    ):
+        self.records = tuple(records)
+        self.by_protocol: Dict[str, tuple[int, ...]] = {}
+        self.by_country: Dict[str, tuple[int, ...]] = {}
+        protocols: Dict[str, list[int]] = {}
+        by_country: Dict[str, list[int]] = {c: [] for c in countries}
+        if classify is None:
+            wanted = frozenset(countries)
+
+            def classify(rec: ConfigRecord) -> Optional[str]:
+                return next((w for w in _WORD_RE.findall(rec.remark.lower()) if w in wanted), None)
+
+        for rec in self.records:
+            protocols.setdefault(rec.protocol, []).append(rec.offset)
+            country = classify(rec)
+            if country is not None:
+                by_country.setdefault(country, []).append(rec.offset)
+        self.by_protocol = {k: tuple(v) for k, v in protocols.items()}
+        self.by_country = {k: tuple(v) for k, v in by_country.items()}
+        self._country_sets: Dict[str, frozenset[int]] = {}
+        self._selections: Dict[tuple, tuple[ConfigRecord, ...]] = {}
+
+    @classmethod
+    def build(
+        cls,
+        raw_configs: Iterable[str],
+        countries: Sequence[str] = (),
+        previous: Optional["ConfigIndex"] = None,
+        classify: Optional[Callable[[ConfigRecord], Optional[str]]] = None,
+    ) -> "ConfigIndex":
+        parsed = {rec.raw: rec for rec in previous.records} if previous else {}
+        seen: set[int] = set()
+        records: list[ConfigRecord] = []
+        for raw in raw_configs:
+            old = parsed.get(raw)
+            if old is not None:
+                rec = ConfigRecord(old.protocol, old.host, old.port, old.remark, old.fingerprint, len(records), old.raw)
+            else:
+                rec = parse_config(raw, len(records))
+            if rec.fingerprint in seen:
+                continue
+            seen.add(rec.fingerprint)
+            records.append(rec)
+        return cls(records, countries, classify)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def select(self, protocol: Optional[str] = None, country: Optional[str] = None) -> tuple[ConfigRecord, ...]:
+        if protocol is None and country is None:
+            return self.records
+        key = (protocol and protocol.lower(), country and country.lower())
+        found = self._selections.get(key)
+        if found is None:
+            found = self._selections[key] = self._select(*key)
+        return found
+
+    def _select(self, protocol: Optional[str], country: Optional[str]) -> tuple[ConfigRecord, ...]:
+        offsets: Optional[Sequence[int]] = None
+        if protocol is not None:
+            offsets = self.by_protocol.get(protocol, ())
+        if country is not None:
+            by_country = self.by_country.get(country)
+            if by_country is None:
+                return ()
+            if offsets is None:
+                offsets = by_country
+            else:
+                allowed = self.country_set(country)
+                offsets = [o for o in offsets if o in allowed]
+        return tuple(self.records[o] for o in offsets)
+
+    def country_set(self, country: str) -> frozenset[int]:
+        country = country.lower()
+        found = self._country_sets.get(country)
+        if found is None:
+            found = self._country_sets[country] = frozenset(self.by_country.get(country, ()))
+        return found
+
+    def filter(self, records: Sequence[ConfigRecord], country: str) -> list[ConfigRecord]:
+        allowed = self.country_set(country)
+        return [rec for rec in records if rec.offset in allowed and self.records[rec.offset] is rec]
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence
+
+from config_index import ConfigIndex, ConfigRecord
+from source_schedule import SourceSchedule
+from sources import RefreshReport, SourceFetcher
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    version: int
+    index: ConfigIndex
+    created_at: float
+
+    @property
+    def records(self) -> tuple[ConfigRecord, ...]:
+        return self.index.records
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+class ConfigPool:
+    """Process-wide pool of configs, published as immutable versioned snapshots.
+
+    Handlers only ever read ``snapshot``; network I/O happens in ``refresh``,
+    which runs from ``run`` or once on first demand from ``get``. ``run``
+    refreshes each source when ``schedule`` says it is due, with the timeout
+    the schedule picked for it. A pool with ``fetch_on_demand`` off never
+    fetches by itself and is fed through ``restore`` instead (worker
+    processes).
+    """
+
+    def __init__(
+        self,
+        sources: Sequence[str],
+        refresh_interval: float,
+        fetch_timeout: float = 15,
+        countries: Sequence[str] = (),
+        fetch_on_demand: bool = True,
+        classify: Optional[Callable[[ConfigRecord], Optional[str]]] = None,
+    ):
+        self.countries = tuple(countries)
+        self.classify = classify
+        self.fetch_on_demand = fetch_on_demand
+        self.fetcher = SourceFetcher(sources, timeout=fetch_timeout)
+        self.refresh_interval = refresh_interval
+        self.schedule = SourceSchedule(self.fetcher.states, refresh_interval, fetch_timeout)
+        self._snapshot: Optional[Snapshot] = None
+        self.refreshed_at: Optional[float] = None
+        self._version = 0
+        self._lock = asyncio.Lock()
+        self._listeners: List[Callable[[Snapshot], None]] = []
+        self.observers: List[Callable[[RefreshReport], None]] = []
+        self._published = asyncio.Event()
+
+    @property
+    def snapshot(self) -> Optional[Snapshot]:
+        return self._snapshot
+
+    def subscribe(self, callback: Callable[[Snapshot], None]) -> None:
+        self._listeners.append(callback)
+
+    async def get(self) -> Optional[Snapshot]:
+        if self._snapshot is not None:
+            return self._snapshot
+        if not self.fetch_on_demand:
+            try:
+                await asyncio.wait_for(self._published.wait(), self.fetcher.timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self._snapshot
+        async with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            return await self._refresh_locked()
+
+    async def refresh(self, urls: Optional[Sequence[str]] = None) -> Optional[Snapshot]:
+        async with self._lock:
+            return await self._refresh_locked(urls)
+
+    def restore(self, index: ConfigIndex, refreshed_at: float, replace: bool = False) -> Optional[Snapshot]:
+        if (self._snapshot is not None and not replace) or not len(index):
+            return self._snapshot
+        self.refreshed_at = refreshed_at
+        return self._publish(index, len(index))
+
+    async def reclassify(self, version: int) -> Optional[Snapshot]:
+        """Runs ``classify`` over snapshot ``version`` again, e.g. once DNS answers for GeoIP are in.
+
+        Publishes a new snapshot only if some country changed, and does nothing
+        if ``version`` is no longer current (the newer one was classified with
+        at least as much known).
+        """
+        async with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                return None
+            index = await asyncio.to_thread(ConfigIndex, snapshot.records, self.countries, self.classify)
+            if index.by_country == snapshot.index.by_country:
+                return None
+            return self._publish(index, len(index))
+
+    async def _refresh_locked(self, urls: Optional[Sequence[str]] = None) -> Optional[Snapshot]:
+        if self._snapshot is not None:
+            self.schedule.update_yields(self._snapshot.index)
+        urls = list(urls) if urls is not None else list(self.fetcher.states)
+        report = await self.fetcher.refresh(urls, self.schedule.timeouts(urls))
+        for url in report.changed:
+            self.schedule.record(url, True)
+        for url in report.unchanged:
+            self.schedule.record(url, False)
+        for url in report.failed:
+            self.schedule.record(url, None)
+        for observer in self.observers:
+            observer(report)
+        self.refreshed_at = time.time()
+        logger.info(f"Источники: {report.summary()}")
+        for url in report.changed:
+            state = self.fetcher.states[url]
+            logger.info(
+                f"Источник изменён: {url} (+{state.last_added}/-{state.last_removed}, "
+                f"{state.last_bytes / 1024:.0f} KB, {state.last_duration * 1000:.0f}ms)"
+            )
+        if self._snapshot is not None and not report.changed:
+            return self._snapshot
+        configs = self.fetcher.merged()
+        if not configs:
+            logger.warning("Не удалось обновить пул конфигов: источники вернули пустой результат")
+            return self._snapshot
+        previous = self._snapshot.index if self._snapshot else None
+        index = await asyncio.to_thread(ConfigIndex.build, configs, self.countries, previous, self.classify)
+        return self._publish(index, len(configs))
+
+    def _publish(self, index: ConfigIndex, raw_count: int) -> Snapshot:
+        self._version += 1
+        snapshot = Snapshot(version=self._version, index=index, created_at=time.time())
+        self._snapshot = snapshot
+        self._published.set()
+        logger.info(f"Пул конфигов v{snapshot.version}: {len(snapshot)} конфигов ({raw_count} строк до дедупликации)")
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика обновления пула: {e}", exc_info=True)
+        return snapshot
+
+    async def run(self) -> None:
+        while True:
+            delay = self.schedule.min_interval
+            try:
+                due = self.schedule.due()
+                if due:
+                    await self.refresh(due)
+                delay = self.schedule.next_due() - time.monotonic()
+            except Exception as e:
+                logger.error(f"Ошибка обновления пула конфигов: {e}", exc_info=True)
+            await asyncio.sleep(max(1.0, delay))
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token bucket shared by every outbound Bot API call."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+
+class ThrottleMiddleware(BaseRequestMiddleware):
+    """Bounds the bot's global API rate and retries calls hit by flood control."""
+
+    def __init__(self, limiter: RateLimiter, max_retries: int = 3):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.retries = 0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                delay = e.retry_after * attempt
+                logger.warning(f"Flood control на {type(method).__name__}, повтор через {delay}s")
+                await asyncio.sleep(delay)
+
+
+class _Update:
+    __slots__ = ("text", "kwargs", "key", "waiters")
+
+    def __init__(self, text: str, kwargs: dict, key: tuple):
+        self.text = text
+        self.kwargs = kwargs
+        self.key = key
+        self.waiters: list[asyncio.Future] = []
+
+
+class _MessageState:
+    __slots__ = ("pending", "last_key", "last_at", "worker")
+
+    def __init__(self):
+        self.pending: Optional[_Update] = None
+        self.last_key: Optional[tuple] = None
+        self.last_at = 0.0
+        self.worker: Optional[asyncio.Task] = None
+
+
+class MessageEditor:
+    """Per-message edit pipeline.
+
+    Each message gets at most one edit every ``min_interval`` seconds. Updates
+    submitted while an edit is pending replace it (only the latest is sent and
+    earlier callers are resolved with its result), and edits identical to what
+    the message already shows are skipped.
+    """
+
+    def __init__(self, min_interval: float = 1.0, max_messages: int = 10000):
+        self.min_interval = min_interval
+        self.max_messages = max_messages
+        self._states: "OrderedDict[tuple[int, int], _MessageState]" = OrderedDict()
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.failed = 0
+
+    async def edit(self, message: Message, text: str, wait: bool = True, **kwargs: Any) -> bool:
+        key = (message.chat.id, message.message_id)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _MessageState()
+            self._evict()
+        self._states.move_to_end(key)
+        markup = kwargs.get("reply_markup")
+        update = _Update(text, kwargs, (text, markup.model_dump_json() if markup is not None else None, kwargs.get("parse_mode")))
+        if state.pending is not None:
+            update.waiters = state.pending.waiters
+            self.coalesced += 1
+        state.pending = update
+        future = asyncio.get_running_loop().create_future()
+        update.waiters.append(future)
+        if state.worker is None or state.worker.done():
+            state.worker = asyncio.create_task(self._drain(message, state))
+        if not wait:
+            return True
+        return await asyncio.shield(future)
+
+    def _evict(self) -> None:
+        while len(self._states) > self.max_messages:
+            for key, state in self._states.items():
+                if state.worker is None or state.worker.done():
+                    del self._states[key]
+                    break
+            else:
+                return
+
+    async def _drain(self, message: Message, state: _MessageState) -> None:
+        while state.pending is not None:
+            delay = state.last_at + self.min_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            update, state.pending = state.pending, None
+            if update.key == state.last_key:
+                self.skipped += 1
+                self._resolve(update, True)
+                continue
+            ok = True
+            try:
+                await message.edit_text(update.text, **update.kwargs)
+                self.sent += 1
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    self.skipped += 1
+                else:
+                    ok = False
+                    self.failed += 1
+                    logger.warning(f"Не удалось отредактировать сообщение: {e}")
+            except Exception as e:
+                ok = False
+                self.failed += 1
+                logger.warning(f"Не удалось отредактировать сообщение: {e}")
+            state.last_at = time.monotonic()
+            if ok:
+                state.last_key = update.key
+            self._resolve(update, ok)
+
+    @staticmethod
+    def _resolve(update: _Update, ok: bool) -> None:
+        for future in update.waiters:
+            if not future.done():
+                future.set_result(ok)
+
+    def stats(self) -> dict:
+        return {
+            "messages": len(self._states),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
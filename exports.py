@@ -0,0 +1,268 @@
+import asyncio
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Sequence
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from config_index import ConfigRecord
+
+FORMATS = ("txt", "b64", "clash", "singbox")
+FORMAT_LABELS = {"txt": "TXT", "b64": "Base64", "clash": "Clash", "singbox": "sing-box"}
+FORMAT_EXTENSIONS = {"txt": "txt", "b64": "txt", "clash": "yaml", "singbox": "json"}
+
+
+def _query(raw: str) -> Dict[str, str]:
+    parts = urlsplit(raw)
+    return {k: v[0] for k, v in parse_qs(parts.query).items() if v}
+
+
+def _decode_b64(text: str) -> str:
+    text = text.strip()
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4)).decode("utf-8", errors="ignore")
+
+
+def proxy_from_record(rec: ConfigRecord) -> Optional[dict]:
+    """Normalized outbound description shared by the Clash and sing-box renderers."""
+    if not rec.address:
+        return None
+    proxy = {
+        "name": rec.remark or f"{rec.protocol}-{rec.host}:{rec.port}",
+        "type": rec.protocol,
+        "server": rec.host.strip("[]"),
+        "port": rec.port,
+    }
+    try:
+        if rec.protocol == "vmess":
+            data = json.loads(_decode_b64(rec.raw.split("://", 1)[1].split("#")[0]))
+            proxy.update(
+                uuid=str(data.get("id", "")),
+                alter_id=int(data.get("aid") or 0),
+                cipher=data.get("scy") or "auto",
+                network=data.get("net") or "tcp",
+                tls=data.get("tls") == "tls",
+                sni=data.get("sni") or data.get("host") or "",
+                host=data.get("host") or "",
+                path=data.get("path") or "",
+            )
+        elif rec.protocol in ("vless", "trojan"):
+            parts = urlsplit(rec.raw)
+            params = _query(rec.raw)
+            secret = unquote(parts.username or "")
+            proxy["uuid" if rec.protocol == "vless" else "password"] = secret
+            security = params.get("security", "tls" if rec.protocol == "trojan" else "none")
+            proxy.update(
+                network=params.get("type", "tcp"),
+                tls=security in ("tls", "reality", "xtls"),
+                sni=params.get("sni") or params.get("peer") or "",
+                host=params.get("host", ""),
+                path=params.get("path") or params.get("serviceName") or "",
+                flow=params.get("flow", ""),
+                fingerprint=params.get("fp", ""),
+            )
+            if security == "reality":
+                proxy.update(reality_public_key=params.get("pbk", ""), reality_short_id=params.get("sid", ""))
+        elif rec.protocol == "ss":
+            body = rec.raw.split("://", 1)[1].split("#")[0].split("?")[0]
+            userinfo = body.rsplit("@", 1)[0] if "@" in body else _decode_b64(body).rsplit("@", 1)[0]
+            if ":" not in userinfo:
+                userinfo = _decode_b64(unquote(userinfo))
+            cipher, _, password = userinfo.partition(":")
+            if not cipher or not password:
+                return None
+            proxy.update(cipher=cipher, password=password)
+        else:
+            return None
+    except Exception:
+        return None
+    return proxy
+
+
+def _clash_proxy(p: dict) -> dict:
+    out = {"name": p["name"], "type": p["type"], "server": p["server"], "port": p["port"]}
+    if p["type"] == "ss":
+        out.update(cipher=p["cipher"], password=p["password"])
+        return out
+    if p["type"] == "vmess":
+        out.update(uuid=p["uuid"], alterId=p["alter_id"], cipher=p["cipher"])
+    elif p["type"] == "vless":
+        out["uuid"] = p["uuid"]
+        if p.get("flow"):
+            out["flow"] = p["flow"]
+    else:
+        out["password"] = p["password"]
+    out["udp"] = True
+    if p.get("tls"):
+        out["tls"] = True
+        if p.get("sni"):
+            out["servername" if p["type"] != "trojan" else "sni"] = p["sni"]
+        if p.get("fingerprint"):
+            out["client-fingerprint"] = p["fingerprint"]
+        if p.get("reality_public_key"):
+            out["reality-opts"] = {"public-key": p["reality_public_key"], "short-id": p.get("reality_short_id", "")}
+    network = p.get("network", "tcp")
+    if network != "tcp":
+        out["network"] = network
+        if network == "ws":
+            out["ws-opts"] = {"path": p.get("path") or "/", "headers": {"Host": p["host"]} if p.get("host") else {}}
+        elif network == "grpc":
+            out["grpc-opts"] = {"grpc-service-name": p.get("path", "")}
+    return out
+
+
+def _singbox_outbound(p: dict) -> dict:
+    types = {"ss": "shadowsocks", "vmess": "vmess", "vless": "vless", "trojan": "trojan"}
+    out = {"type": types[p["type"]], "tag": p["name"], "server": p["server"], "server_port": p["port"]}
+    if p["type"] == "ss":
+        out.update(method=p["cipher"], password=p["password"])
+        return out
+    if p["type"] == "vmess":
+        out.update(uuid=p["uuid"], alter_id=p["alter_id"], security=p["cipher"])
+    elif p["type"] == "vless":
+        out["uuid"] = p["uuid"]
+        if p.get("flow"):
+            out["flow"] = p["flow"]
+    else:
+        out["password"] = p["password"]
+    if p.get("tls"):
+        tls = {"enabled": True}
+        if p.get("sni"):
+            tls["server_name"] = p["sni"]
+        if p.get("fingerprint"):
+            tls["utls"] = {"enabled": True, "fingerprint": p["fingerprint"]}
+        if p.get("reality_public_key"):
+            tls["reality"] = {"enabled": True, "public_key": p["reality_public_key"], "short_id": p.get("reality_short_id", "")}
+        out["tls"] = tls
+    network = p.get("network", "tcp")
+    if network == "ws":
+        transport = {"type": "ws", "path": p.get("path") or "/"}
+        if p.get("host"):
+            transport["headers"] = {"Host": p["host"]}
+        out["transport"] = transport
+    elif network == "grpc":
+        out["transport"] = {"type": "grpc", "service_name": p.get("path", "")}
+    return out
+
+
+def _unique_names(proxies: list[dict]) -> list[dict]:
+    seen: Dict[str, int] = {}
+    for p in proxies:
+        name = p["name"]
+        if name in seen:
+            seen[name] += 1
+            p["name"] = f"{name} #{seen[name]}"
+        else:
+            seen[name] = 1
+    return proxies
+
+
+def render_txt(records: Sequence[ConfigRecord]) -> bytes:
+    return "\n".join(rec.raw for rec in records).encode("utf-8")
+
+
+def render_b64(records: Sequence[ConfigRecord]) -> bytes:
+    return base64.b64encode(render_txt(records))
+
+
+def render_clash(records: Sequence[ConfigRecord]) -> bytes:
+    proxies = _unique_names([p for p in map(proxy_from_record, records) if p])
+    lines = ["proxies:"]
+    lines += [f"  - {json.dumps(_clash_proxy(p), ensure_ascii=False)}" for p in proxies]
+    names = json.dumps([p["name"] for p in proxies], ensure_ascii=False)
+    lines += [
+        "proxy-groups:",
+        f'  - {{"name": "auto", "type": "url-test", "url": "http://www.gstatic.com/generate_204", "interval": 300, "proxies": {names}}}',
+        "rules:",
+        "  - MATCH,auto",
+    ]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def render_singbox(records: Sequence[ConfigRecord]) -> bytes:
+    outbounds = [_singbox_outbound(p) for p in _unique_names([p for p in map(proxy_from_record, records) if p])]
+    tags = [o["tag"] for o in outbounds]
+    config = {
+        "outbounds": [
+            {"type": "urltest", "tag": "auto", "outbounds": tags},
+            *outbounds,
+            {"type": "direct", "tag": "direct"},
+        ]
+    }
+    return json.dumps(config, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+RENDERERS: Dict[str, Callable[[Sequence[ConfigRecord]], bytes]] = {
+    "txt": render_txt,
+    "b64": render_b64,
+    "clash": render_clash,
+    "singbox": render_singbox,
+}
+
+
+class Artifact:
+    __slots__ = ("data", "filename", "count", "file_id", "lock")
+
+    def __init__(self, data: bytes, filename: str, count: int):
+        self.data = data
+        self.filename = filename
+        self.count = count
+        self.file_id: Optional[str] = None
+        self.lock = asyncio.Lock()
+
+
+def selection_key(records: Sequence[ConfigRecord]) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    for rec in records:
+        digest.update(rec.fingerprint.to_bytes(8, "big"))
+    return digest.hexdigest()
+
+
+class ExportCache:
+    """Rendered exports memoized per snapshot version, selection and format.
+
+    The key is built from the record fingerprints, so every user asking for
+    the same list shares one payload, one render and, once uploaded, one
+    Telegram ``file_id``. Concurrent requests for a missing artifact wait for
+    a single render; the cache is LRU-bounded by total payload size.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[tuple, Artifact]" = OrderedDict()
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, version: int, records: Sequence[ConfigRecord], fmt: str, label: str) -> Artifact:
+        key = (version, label, fmt, len(records), selection_key(records))
+        artifact = self._items.get(key)
+        if artifact is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return artifact
+        future = self._inflight.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._render(key, tuple(records), fmt, label))
+            self._inflight[key] = future
+        else:
+            self.hits += 1
+        return await asyncio.shield(future)
+
+    async def _render(self, key: tuple, records: tuple, fmt: str, label: str) -> Artifact:
+        try:
+            data = await asyncio.to_thread(RENDERERS[fmt], records)
+            artifact = Artifact(data, f"configs_{label}.{FORMAT_EXTENSIONS[fmt]}", len(records))
+            self._items[key] = artifact
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                _, old = self._items.popitem(last=False)
+                self._bytes -= len(old.data)
+            return artifact
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"items": len(self._items), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,172 @@
+"""Local Bot API stand-in and load driver for offline throughput tests.
+
+Run the bot in webhook mode against it:
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook python main.py
+    python fake_telegram.py --webhook http://127.0.0.1:8080/webhook --users 50 --rounds 20
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Dict, Optional, Sequence
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+DEFAULT_SCRIPT = ("/start", "get:all", "page:1", "page:2", "page:1", "back_to_main")
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class FakeTelegram:
+    """Answers Bot API calls with plausible results and reports when a chat got its reply."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1000)
+        self.last_message: Dict[int, int] = {}
+        self._chat_waiters: Dict[int, asyncio.Future] = {}
+        self._callback_waiters: Dict[str, asyncio.Future] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def expect_chat(self, chat_id: int) -> asyncio.Future:
+        future = self._chat_waiters[chat_id] = asyncio.get_running_loop().create_future()
+        return future
+
+    def expect_callback(self, callback_id: str) -> asyncio.Future:
+        future = self._callback_waiters[callback_id] = asyncio.get_running_loop().create_future()
+        return future
+
+    def message(self, chat_id: int, text: str = "", message_id: Optional[int] = None) -> dict:
+        message_id = message_id or next(self._message_ids)
+        self.last_message[chat_id] = message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result: object = True
+        chat_id = int(params["chat_id"]) if "chat_id" in params else None
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "editMessageText") and chat_id is not None:
+            message_id = int(params["message_id"]) if "message_id" in params else None
+            result = self.message(chat_id, str(params.get("text", "")), message_id)
+        elif method == "sendDocument" and chat_id is not None:
+            result = self.message(chat_id)
+            result["document"] = {"file_id": f"file{result['message_id']}", "file_unique_id": f"u{result['message_id']}"}
+        if method == "answerCallbackQuery":
+            waiter = self._callback_waiters.pop(str(params.get("callback_query_id")), None)
+        elif chat_id is not None and method.startswith(("send", "edit")):
+            waiter = self._chat_waiters.pop(chat_id, None)
+        else:
+            waiter = None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(time.monotonic())
+        return web.json_response({"ok": True, "result": result})
+
+
+class LoadDriver:
+    """Closed-loop users: each posts an update and waits for the bot's reply before the next."""
+
+    def __init__(self, fake: FakeTelegram, webhook_url: str, script: Sequence[str], timeout: float = 30.0):
+        self.fake = fake
+        self.webhook_url = webhook_url
+        self.script = script
+        self.timeout = timeout
+        self._update_ids = itertools.count(1)
+        self.latencies: list[float] = []
+        self.timeouts = 0
+
+    def _update(self, user_id: int, step: str) -> tuple[dict, asyncio.Future]:
+        update_id = next(self._update_ids)
+        user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+        chat = {"id": user_id, "type": "private"}
+        if step.startswith("/"):
+            message = {"message_id": update_id, "date": int(time.time()), "chat": chat, "from": user, "text": step}
+            return {"update_id": update_id, "message": message}, self.fake.expect_chat(user_id)
+        message = self.fake.message(user_id, message_id=self.fake.last_message.get(user_id))
+        callback = {"id": str(update_id), "from": user, "chat_instance": str(user_id), "data": step, "message": message}
+        return {"update_id": update_id, "callback_query": callback}, self.fake.expect_callback(str(update_id))
+
+    async def _user(self, session: aiohttp.ClientSession, user_id: int, rounds: int) -> None:
+        for step in itertools.islice(itertools.cycle(self.script), rounds * len(self.script)):
+            update, reply = self._update(user_id, step)
+            started = time.monotonic()
+            async with session.post(self.webhook_url, json=update) as resp:
+                await resp.read()
+            try:
+                done = await asyncio.wait_for(reply, self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                continue
+            self.latencies.append(done - started)
+
+    async def run(self, users: int, rounds: int) -> dict:
+        started = time.monotonic()
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(self._user(session, 10_000 + i, rounds) for i in range(users)))
+        elapsed = time.monotonic() - started
+        return {
+            "updates": len(self.latencies) + self.timeouts,
+            "timeouts": self.timeouts,
+            "elapsed_s": round(elapsed, 2),
+            "updates_per_s": round(len(self.latencies) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(self.latencies, 0.5) * 1000, 1),
+            "p95_ms": round(percentile(self.latencies, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(self.latencies, 0.99) * 1000, 1),
+            "api_calls": dict(self.fake.calls),
+        }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--script", default=",".join(DEFAULT_SCRIPT), help="comma-separated commands / callback data")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0)
+    parser.add_argument("--serve-only", action="store_true", help="only run the fake API")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(latency=args.api_latency_ms / 1000)
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"Fake Bot API on http://{args.host}:{args.port}")
+    try:
+        if args.serve_only:
+            await asyncio.Event().wait()
+        driver = LoadDriver(fake, args.webhook, args.script.split(","))
+        print(json.dumps(await driver.run(args.users, args.rounds), indent=2))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,280 @@
+import bisect
+import csv
+import gzip
+import ipaddress
+import logging
+import re
+import socket
+import threading
+import time
+from array import array
+from typing import Container, Dict, Iterable, Optional, Sequence
+
+from config_index import ConfigRecord
+from resolver import DnsCache, is_ip_literal
+
+logger = logging.getLogger(__name__)
+
+ISO_CODES = frozenset("""
+AD AE AF AG AI AL AM AO AQ AR AS AT AU AW AX AZ BA BB BD BE BF BG BH BI BJ BL BM BN BO BQ BR BS BT BV BW BY BZ
+CA CC CD CF CG CH CI CK CL CM CN CO CR CU CV CW CX CY CZ DE DJ DK DM DO DZ EC EE EG EH ER ES ET FI FJ FK FM FO FR
+GA GB GD GE GF GG GH GI GL GM GN GP GQ GR GS GT GU GW GY HK HM HN HR HT HU ID IE IL IM IN IO IQ IR IS IT JE JM JO
+JP KE KG KH KI KM KN KP KR KW KY KZ LA LB LC LI LK LR LS LT LU LV LY MA MC MD ME MF MG MH MK ML MM MN MO MP MQ MR
+MS MT MU MV MW MX MY MZ NA NC NE NF NG NI NL NO NP NR NU NZ OM PA PE PF PG PH PK PL PM PN PR PS PT PW PY QA RE RO
+RS RU RW SA SB SC SD SE SG SH SI SJ SK SL SM SN SO SR SS ST SV SX SY SZ TC TD TF TG TH TJ TK TL TM TN TO TR TT TV
+TW TZ UA UG UM US UY UZ VA VC VE VG VI VN VU WF WS YE YT ZA ZM ZW
+""".split())
+# Codes that are also common words or tags in remarks ("IN GERMANY", "NO LIMIT",
+# "IT dept", "WS" transport, "ID" numbers); they count only as a flag, a hint
+# or the remark's last word.
+AMBIGUOUS_CODES = frozenset("""
+AD AI AM AS AT BE BY DO ID IN IS IT ME MY NO SO TO TV WS
+""".split())
+CODE_ALIASES = {"UK": "GB", "EN": "GB"}
+
+_FLAG_RE = re.compile("[\U0001F1E6-\U0001F1FF]{2}")
+_WORD_RE = re.compile("[A-Za-z]+")
+_REGIONAL_A = 0x1F1E6
+
+
+def remark_country(remark: str, hints: Container[str] = ()) -> Optional[str]:
+    """Country from a remark: a flag emoji, else a standalone ISO code.
+
+    Upper-case codes listed in ``hints`` win over other upper-case codes;
+    codes that double as words (``AMBIGUOUS_CODES``) only count when hinted
+    or when they are the remark's last word. Lower-case codes count only
+    when hinted, so "de" in "Server de Madrid" needs a hint. Returns a
+    lower-case code or ``None``.
+
+    >>> [remark_country(r, ("de", "us", "nl")) for r in (
+    ...     "FREE IN GERMANY DE", "NO LIMIT | DE", "TO US server", "@channel - IT dept - NL")]
+    ['de', 'de', 'us', 'nl']
+    >>> [remark_country(r) for r in ("Server IN Tokyo JP", "Milano - IT", "\U0001F1EE\U0001F1F9 no limit", "AT&T")]
+    ['jp', 'it', 'it', None]
+    >>> remark_country("Server de Madrid", ("de",)), remark_country("Server de Madrid ES", ("de",))
+    ('de', 'es')
+    """
+    if not remark:
+        return None
+    flag = _FLAG_RE.search(remark)
+    if flag is not None:
+        code = "".join(chr(ord(c) - _REGIONAL_A + ord("A")) for c in flag.group())
+        if code in ISO_CODES:
+            return code.lower()
+    words = _WORD_RE.findall(remark)
+    bare: Optional[str] = None
+    lowered: Optional[str] = None
+    for i, word in enumerate(words):
+        if len(word) != 2:
+            continue
+        upper = CODE_ALIASES.get(word.upper(), word.upper())
+        if upper not in ISO_CODES:
+            continue
+        code = upper.lower()
+        if word.isupper():
+            if code in hints:
+                return code
+            if bare is None and (upper not in AMBIGUOUS_CODES or i == len(words) - 1):
+                bare = code
+        elif lowered is None and word.islower() and code in hints:
+            lowered = code
+    return bare or lowered
+
+
+def _ip_value(text: str) -> Optional[int]:
+    text = text.strip()
+    if text.isdigit():
+        return int(text)
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6 if ":" in text else socket.AF_INET, text), "big")
+    except OSError:
+        return None
+
+
+class GeoIPTable:
+    """IP range → country table searched with ``bisect``.
+
+    Loaded from a CSV range table (``.csv`` or ``.csv.gz``) whose rows start
+    with the first and last address of a range, either as IP strings or as
+    integers (db-ip / IP2Location "lite" layouts), followed by the ISO code.
+    IPv4 ranges live in compact unsigned arrays; IPv6 ones in plain lists.
+    """
+
+    def __init__(self):
+        self._codes: list[str] = []
+        self._v4_starts = array("I")
+        self._v4_ends = array("I")
+        self._v4_codes = array("H")
+        self._v6_starts: list[int] = []
+        self._v6_ends: list[int] = []
+        self._v6_codes = array("H")
+
+    def __len__(self) -> int:
+        return len(self._v4_starts) + len(self._v6_starts)
+
+    @classmethod
+    def load(cls, path: str) -> "GeoIPTable":
+        table = cls()
+        code_ids: Dict[str, int] = {}
+        v4: list[tuple[int, int, int]] = []
+        v6: list[tuple[int, int, int]] = []
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8", newline="") as f:
+            for row in csv.reader(f):
+                if len(row) < 3:
+                    continue
+                start, end = _ip_value(row[0]), _ip_value(row[1])
+                code = next((c.strip().upper() for c in row[2:] if len(c.strip()) == 2), None)
+                if start is None or end is None or code is None or code not in ISO_CODES:
+                    continue
+                code_id = code_ids.setdefault(code, len(code_ids))
+                is_v4 = end <= 0xFFFFFFFF and ":" not in row[0]
+                (v4 if is_v4 else v6).append((start, end, code_id))
+        table._codes = [code.lower() for code in code_ids]
+        v4.sort()
+        v6.sort()
+        table._v4_starts.extend(r[0] for r in v4)
+        table._v4_ends.extend(r[1] for r in v4)
+        table._v4_codes.extend(r[2] for r in v4)
+        table._v6_starts = [r[0] for r in v6]
+        table._v6_ends = [r[1] for r in v6]
+        table._v6_codes.extend(r[2] for r in v6)
+        return table
+
+    def lookup(self, ip: str) -> Optional[str]:
+        try:
+            addr = ipaddress.ip_address(ip.strip("[]"))
+        except ValueError:
+            return None
+        if addr.version == 6 and addr.ipv4_mapped is not None:
+            addr = addr.ipv4_mapped
+        value = int(addr)
+        if addr.version == 4:
+            starts, ends, codes = self._v4_starts, self._v4_ends, self._v4_codes
+        else:
+            starts, ends, codes = self._v6_starts, self._v6_ends, self._v6_codes
+        i = bisect.bisect_right(starts, value) - 1
+        if i < 0 or value > ends[i]:
+            return None
+        return self._codes[codes[i]]
+
+
+class CountryClassifier:
+    """Assigns each config the country of its endpoint.
+
+    IP literals, and host names the DNS cache has already resolved, are
+    looked up in the GeoIP table at ``path`` (loaded on first use; results
+    are cached per IP, and per host name so they outlive the DNS entry).
+    Configs without a GeoIP answer fall back to flag emoji or ISO codes in
+    the remark. Works without a table too, on remarks alone.
+
+    Indexes are built before the DNS cache is warm, so ``warm`` resolves the
+    host names of a snapshot that have no answer yet; classifying the same
+    records afterwards picks up their GeoIP countries.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        resolver: Optional[DnsCache] = None,
+        hints: Sequence[str] = (),
+        max_cached: int = 200000,
+    ):
+        self.path = path
+        self.resolver = resolver
+        self.hints = frozenset(h.lower() for h in hints)
+        self.max_cached = max_cached
+        self._table: Optional[GeoIPTable] = None
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._by_ip: Dict[str, Optional[str]] = {}
+        self._by_host: Dict[str, Optional[str]] = {}
+        self.geoip_hits = 0
+        self.remark_hits = 0
+        self.unknown = 0
+
+    @property
+    def table(self) -> Optional[GeoIPTable]:
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self._table = self._load()
+                    self._loaded = True
+        return self._table
+
+    def _load(self) -> Optional[GeoIPTable]:
+        if not self.path:
+            return None
+        started = time.monotonic()
+        try:
+            table = GeoIPTable.load(self.path)
+        except FileNotFoundError:
+            logger.info(f"База GeoIP {self.path} не найдена, страны определяются по описанию конфига")
+            return None
+        except Exception as e:
+            logger.error(f"Не удалось загрузить базу GeoIP {self.path}: {e}", exc_info=True)
+            return None
+        logger.info(f"База GeoIP загружена: {len(table)} диапазонов за {(time.monotonic() - started) * 1000:.0f}ms")
+        return table
+
+    def ip_country(self, ip: str) -> Optional[str]:
+        if ip in self._by_ip:
+            return self._by_ip[ip]
+        table = self.table
+        country = table.lookup(ip) if table is not None else None
+        if len(self._by_ip) >= self.max_cached:
+            self._by_ip.clear()
+        self._by_ip[ip] = country
+        return country
+
+    def host_country(self, host: str) -> Optional[str]:
+        if not host:
+            return None
+        host = host.strip("[]")
+        if is_ip_literal(host):
+            return self.ip_country(host)
+        if host in self._by_host:
+            return self._by_host[host]
+        entry = self.resolver.peek(host) if self.resolver is not None else None
+        if entry is None or entry[0] is None:
+            return None
+        country = self.ip_country(entry[0])
+        if len(self._by_host) >= self.max_cached:
+            self._by_host.clear()
+        self._by_host[host] = country
+        return country
+
+    async def warm(self, records: Iterable[ConfigRecord]) -> int:
+        """Resolves host names with no GeoIP answer yet.
+
+        Returns how many of them now have an address, i.e. would be classified
+        differently than before.
+        """
+        if self.resolver is None or self._table is None:
+            return 0
+        hosts = {rec.host for rec in records if rec.host and not is_ip_literal(rec.host.strip("[]"))}
+        unknown = [host for host in hosts if host not in self._by_host]
+        await self.resolver.prefetch(host for host in unknown if self.resolver.peek(host) is None)
+        return sum(1 for host in unknown if (entry := self.resolver.peek(host)) is not None and entry[0] is not None)
+
+    def __call__(self, rec: ConfigRecord) -> Optional[str]:
+        country = self.host_country(rec.host) if self.table is not None else None
+        if country is not None:
+            self.geoip_hits += 1
+            return country
+        country = remark_country(rec.remark, self.hints)
+        if country is not None:
+            self.remark_hits += 1
+        else:
+            self.unknown += 1
+        return country
+
+    def stats(self) -> dict:
+        return {
+            "table_ranges": len(self._table) if self._table is not None else 0,
+            "cached_ips": len(self._by_ip),
+            "cached_hosts": len(self._by_host),
+            "geoip": self.geoip_hits,
+            "remark": self.remark_hits,
+            "unknown": self.unknown,
+        }
@@ -0,0 +1,100 @@
+import math
+from array import array
+from typing import Optional
+
+EWMA_ALPHA = 0.3
+JITTER_ALPHA = 0.25
+JITTER_WEIGHT = 2.0
+MIN_SUCCESS_RATIO = 0.25
+HISTORY_SIZE = 16
+
+
+class LatencyHistory:
+    """Recent probe results of one endpoint.
+
+    The last ``HISTORY_SIZE`` samples live in a float32 ring buffer (NaN marks
+    a failed probe); EWMA latency, jitter (smoothed absolute difference of
+    consecutive successful samples) and the success count over the window
+    are kept incrementally, so ``score`` is O(1).
+    """
+
+    __slots__ = (
+        "samples", "pos", "count", "ok", "ewma", "jitter", "last_ok",
+        "probes", "failures", "last_value", "last_probe", "requests",
+    )
+
+    def __init__(self):
+        self.samples = array("f", [math.nan]) * HISTORY_SIZE
+        self.pos = 0
+        self.count = 0
+        self.ok = 0
+        self.ewma: Optional[float] = None
+        self.jitter = 0.0
+        self.last_ok: Optional[float] = None
+        self.probes = 0
+        self.failures = 0
+        self.last_value: Optional[float] = None
+        self.last_probe = 0.0
+        self.requests = 0
+
+    def record(self, value: Optional[float], now: float) -> None:
+        self.probes += 1
+        self.last_probe = now
+        self.last_value = value
+        if self.count == HISTORY_SIZE:
+            if not math.isnan(self.samples[self.pos]):
+                self.ok -= 1
+        else:
+            self.count += 1
+        if value is None:
+            self.failures += 1
+            self.samples[self.pos] = math.nan
+        else:
+            self.ok += 1
+            self.samples[self.pos] = value
+            if self.last_ok is not None:
+                self.jitter += JITTER_ALPHA * (abs(value - self.last_ok) - self.jitter)
+            self.last_ok = value
+            self.ewma = value if self.ewma is None else self.ewma + EWMA_ALPHA * (value - self.ewma)
+        self.pos = (self.pos + 1) % HISTORY_SIZE
+
+    @property
+    def success_ratio(self) -> float:
+        return self.ok / self.count if self.count else 0.0
+
+    @property
+    def score(self) -> float:
+        """Composite latency: EWMA plus weighted jitter, inflated by the failure rate."""
+        ratio = self.success_ratio
+        if self.ewma is None or ratio < MIN_SUCCESS_RATIO:
+            return math.inf
+        return (self.ewma + JITTER_WEIGHT * self.jitter) / ratio
+
+    def recent(self) -> list[Optional[float]]:
+        """Samples oldest first, ``None`` for failures."""
+        start = self.pos if self.count == HISTORY_SIZE else 0
+        ordered = [self.samples[(start + i) % HISTORY_SIZE] for i in range(self.count)]
+        return [None if math.isnan(v) else round(v, 1) for v in ordered]
+
+    def dump(self) -> tuple:
+        return (self.ewma, self.jitter, self.last_ok, self.probes, self.failures, self.last_value,
+                self.samples.tobytes(), self.pos, self.count)
+
+    @classmethod
+    def load(cls, ewma, jitter, last_ok, probes, failures, last_value, samples, pos, count, last_probe) -> "LatencyHistory":
+        history = cls()
+        history.ewma = ewma
+        history.jitter = jitter
+        history.last_ok = last_ok
+        history.probes = probes
+        history.failures = failures
+        history.last_value = last_value
+        history.last_probe = last_probe
+        buffer = array("f")
+        buffer.frombytes(samples)
+        if len(buffer) == HISTORY_SIZE:
+            history.samples = buffer
+            history.pos = pos % HISTORY_SIZE
+            history.count = min(count, HISTORY_SIZE)
+            history.ok = sum(1 for v in history.recent() if v is not None)
+        return history
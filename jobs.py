@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class UserJobs:
+    """At most one running operation per user.
+
+    ``run`` with the key of the user's in-flight operation attaches to it
+    instead of starting another; a different key cancels the old operation
+    first, so its probes are released. A caller whose operation was
+    superseded or cancelled gets ``None`` back instead of an exception.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[int, tuple[Hashable, asyncio.Task]] = {}
+        self.started = 0
+        self.attached = 0
+        self.cancelled = 0
+
+    def __contains__(self, user_id: int) -> bool:
+        job = self._jobs.get(user_id)
+        return job is not None and not job[1].done()
+
+    async def run(self, user_id: int, key: Hashable, factory: Callable[[], Awaitable[T]]) -> Optional[T]:
+        current = self._jobs.get(user_id)
+        if current is not None and not current[1].done():
+            if current[0] == key:
+                self.attached += 1
+                return await self._wait(current[1])
+            self.cancel(user_id)
+        task = asyncio.create_task(factory())
+        job = (key, task)
+        self._jobs[user_id] = job
+        self.started += 1
+
+        def forget(_: asyncio.Task) -> None:
+            if self._jobs.get(user_id) is job:
+                del self._jobs[user_id]
+
+        task.add_done_callback(forget)
+        return await self._wait(task)
+
+    @staticmethod
+    async def _wait(task: asyncio.Task) -> Optional[T]:
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                return None
+            raise
+
+    def cancel(self, user_id: int) -> bool:
+        job = self._jobs.pop(user_id, None)
+        if job is None or job[1].done():
+            return False
+        job[1].cancel()
+        self.cancelled += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "running": sum(1 for _, task in self._jobs.values() if not task.done()),
+            "started": self.started,
+            "attached": self.attached,
+            "cancelled": self.cancelled,
+        }
+
+
+class SharedJob(Generic[T]):
+    __slots__ = ("key", "task", "subscribers", "listeners")
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers = 0
+        self.listeners: List[Callable[..., Awaitable[Any]]] = []
+
+
+class SingleFlight:
+    """One task per key, shared by every concurrent caller with that key.
+
+    Callers may pass a ``listener`` that receives whatever the job reports
+    through ``notify`` (progress updates) while they are subscribed. The job
+    is cancelled once its last subscriber is gone.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[Hashable, SharedJob] = {}
+        self.started = 0
+        self.shared = 0
+
+    async def run(
+        self,
+        key: Hashable,
+        factory: Callable[[SharedJob], Awaitable[T]],
+        listener: Optional[Callable[..., Awaitable[Any]]] = None,
+    ) -> T:
+        job = self._jobs.get(key)
+        if job is None or job.task.done():
+            job = SharedJob(key)
+            job.task = asyncio.create_task(factory(job))
+            self._jobs[key] = job
+            self.started += 1
+
+            def forget(_: asyncio.Task) -> None:
+                if self._jobs.get(key) is job:
+                    del self._jobs[key]
+
+            job.task.add_done_callback(forget)
+        else:
+            self.shared += 1
+        job.subscribers += 1
+        if listener is not None:
+            job.listeners.append(listener)
+        try:
+            return await asyncio.shield(job.task)
+        finally:
+            job.subscribers -= 1
+            if listener is not None:
+                job.listeners.remove(listener)
+            if not job.subscribers and not job.task.done():
+                job.task.cancel()
+
+    @staticmethod
+    async def notify(job: SharedJob, *args: Any) -> None:
+        results = await asyncio.gather(*(listener(*args) for listener in list(job.listeners)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка подписчика задачи {job.key}: {result}", exc_info=result)
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._jobs),
+            "subscribers": sum(job.subscribers for job in self._jobs.values()),
+            "started": self.started,
+            "shared": self.shared,
+        }
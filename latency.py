@@ -0,0 +1,195 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, NamedTuple, Optional
+
+from resolver import DnsCache
+
+Endpoint = tuple[str, int]
+
+
+class ProbeTiming(NamedTuple):
+    dns_ms: float
+    connect_ms: float
+
+    @property
+    def total_ms(self) -> float:
+        return round(self.dns_ms + self.connect_ms, 1)
+
+
+async def measure_tcp_timing(
+    host: str,
+    port: int,
+    timeout: float = 3.0,
+    resolver: Optional[DnsCache] = None,
+) -> ProbeTiming | None:
+    """DNS and connect time of one probe; both steps share a single ``timeout``."""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    deadline = started + timeout
+    if resolver is not None:
+        try:
+            address = await asyncio.wait_for(resolver.resolve(host), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        if address is None:
+            return None
+    else:
+        address = host
+    resolved = time.perf_counter()
+    if resolved >= deadline:
+        return None
+    try:
+        transport, _ = await asyncio.wait_for(
+            loop.create_connection(asyncio.Protocol, address, port),
+            timeout=deadline - resolved,
+        )
+    except (OSError, asyncio.TimeoutError, ValueError, OverflowError):
+        return None
+    connected = time.perf_counter()
+    transport.close()
+    return ProbeTiming(round((resolved - started) * 1000, 1), round((connected - resolved) * 1000, 1))
+
+
+async def measure_tcp_ping(
+    host: str,
+    port: int,
+    timeout: float = 3.0,
+    resolver: Optional[DnsCache] = None,
+) -> float | None:
+    timing = await measure_tcp_timing(host, port, timeout, resolver)
+    return timing.connect_ms if timing is not None else None
+
+
+def endpoint_key(host: str, port: int) -> Endpoint:
+    return host.strip().strip("[]").lower(), int(port)
+
+
+class LatencyCache:
+    """Process-wide TTL cache of TCP latencies keyed by ``(host, port)``.
+
+    Concurrent lookups of the same endpoint share one in-flight probe, and the
+    cache is bounded: the least recently used endpoints are evicted first.
+    Extra keyword arguments of ``get``/``refresh`` are passed to ``probe``
+    (e.g. owner and priority for the probe scheduler); a coalesced lookup
+    hands them to ``promote`` instead. A probe nobody waits for any more is
+    cancelled. Every completed probe, and every result handed in through
+    ``report``, is passed to ``observers`` as ``(endpoint, value)``.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_size: int,
+        probe: Callable[..., Awaitable[float | None]] = measure_tcp_ping,
+        promote: Optional[Callable[..., Any]] = None,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.probe = probe
+        self.promote = promote
+        self.observers: list[Callable[[Endpoint, float | None], None]] = []
+        self._entries: "OrderedDict[Endpoint, tuple[float, float | None]]" = OrderedDict()
+        self._inflight: Dict[Endpoint, asyncio.Future] = {}
+        self._waiters: Dict[Endpoint, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, host: str, port: int) -> Optional[tuple[float, float | None]]:
+        entry = self._entries.get(endpoint_key(host, port))
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            return None
+        return entry
+
+    def put(self, host: str, port: int, value: float | None) -> None:
+        key = endpoint_key(host, port)
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def dump(self) -> list[tuple[str, int, float, float | None]]:
+        now = time.monotonic()
+        return [(host, port, now - ts, value) for (host, port), (ts, value) in self._entries.items() if now - ts < self.ttl]
+
+    def load(self, entries: Iterable[tuple[str, int, float, float | None]]) -> int:
+        now = time.monotonic()
+        loaded = 0
+        for host, port, age, value in entries:
+            key = endpoint_key(host, port)
+            current = self._entries.get(key)
+            if age < self.ttl and (current is None or current[0] < now - age):
+                self._entries[key] = (now - age, value)
+                self._entries.move_to_end(key)
+                loaded += 1
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return loaded
+
+    def report(self, host: str, port: int, value: float | None) -> None:
+        """Stores a probe result made elsewhere (e.g. by a probe pool) and tells the observers."""
+        key = endpoint_key(host, port)
+        self.put(*key, value)
+        for observer in self.observers:
+            observer(key, value)
+
+    async def get(self, host: str, port: int, **probe_kwargs) -> float | None:
+        key = endpoint_key(host, port)
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        return await self._join(key, probe_kwargs)
+
+    async def refresh(self, host: str, port: int, **probe_kwargs) -> float | None:
+        return await self._join(endpoint_key(host, port), probe_kwargs)
+
+    async def _join(self, key: Endpoint, probe_kwargs: dict) -> float | None:
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            if self.promote is not None and probe_kwargs:
+                self.promote(*key, **probe_kwargs)
+        else:
+            self.misses += 1
+            future = asyncio.ensure_future(self._probe(key, probe_kwargs))
+            self._inflight[key] = future
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            waiters = self._waiters.pop(key, 1) - 1
+            if waiters:
+                self._waiters[key] = waiters
+            elif not future.done():
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+                future.cancel()
+
+    async def _probe(self, key: Endpoint, probe_kwargs: dict) -> float | None:
+        try:
+            value = await self.probe(*key, **probe_kwargs)
+            self.report(*key, value)
+            return value
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+        }
@@ -1,18 +1,56 @@
 import asyncio
 import logging
+import math
 import os
-import time
-import json
-import base64
-from typing import List, Dict, Optional
+from functools import partial
+from typing import Dict, Optional, Sequence
 from aiogram import Bot, Dispatcher, Router, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-import aiohttp
 from dotenv import load_dotenv
 
+from checkpoint import Checkpointer
+from cluster import Cluster
+from config_index import ConfigRecord
+from config_pool import ConfigPool, Snapshot
+from edits import MessageEditor, RateLimiter, ThrottleMiddleware
+from jobs import SharedJob, SingleFlight, UserJobs
+from exports import FORMAT_LABELS, FORMATS, Artifact, ExportCache
+from geoip import CountryClassifier
+from latency import LatencyCache, measure_tcp_ping
+from metrics import BotMetrics, MetricsRegistry, SamplingProfiler, serve_metrics
+from pages import PageCache
+from prober import HealthProber
+from probe_pool import ProbePool
+from ranking import StreamingRanker
+from resolver import DnsCache
+from serving import ConcurrencyMiddleware, HandlerMetricsMiddleware, run_webhook, serve
+from settings import (
+    CONFIDENT_PING_MS,
+    COUNTRIES,
+    DNS_CACHE_TTL,
+    DNS_NEGATIVE_TTL,
+    GEOIP_DB,
+    MAX_INFLIGHT_PROBES,
+    PING_CACHE_MAX_ENDPOINTS,
+    PING_CACHE_TTL,
+    PROBE_MIN_INTERVAL,
+    PROBE_POOL_CONCURRENCY,
+    PROBE_POOL_RATE,
+    PROBE_PROCESSES,
+    PROBE_RATE,
+    PROBE_TIMEOUT,
+    SOURCES,
+    UPDATE_INTERVAL_MIN,
+)
+from sessions import SessionStore
+from scheduler import BULK, INTERACTIVE, ProbeScheduler
+
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
 if not TOKEN:
@@ -21,122 +59,133 @@ if not TOKEN:
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=TOKEN)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+HANDLER_CONCURRENCY = int(os.getenv("HANDLER_CONCURRENCY", "64"))
+DRAIN_TIMEOUT = 10.0
+WORKERS = int(os.getenv("WORKERS", "1"))
+BOT_ROLE = os.getenv("BOT_ROLE", "coordinator" if WORKERS > 1 else "single")
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+SHARE_INTERVAL = 15
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 0 disables the endpoint; workers serve theirs on METRICS_PORT + 1 + WORKER_INDEX.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+PROFILE_SLOW_HANDLER_MS = int(os.getenv("PROFILE_SLOW_HANDLER_MS", "0"))
+FOLLOW_INTERVAL = 2
+
+if BOT_ROLE == "coordinator" and BOT_MODE != "webhook":
+    raise ValueError("WORKERS > 1 requires BOT_MODE=webhook")
+
+if TELEGRAM_API_URL:
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=TOKEN)
 dp = Dispatcher()
+handler_limiter = ConcurrencyMiddleware(HANDLER_CONCURRENCY)
+dp.update.outer_middleware(handler_limiter)
 router = Router()
 dp.include_router(router)
 
-SOURCES = [
-    "https://raw.githubusercontent.com/barry-far/V2ray-Config/main/All_Configs_Sub.txt",
-    "https://raw.githubusercontent.com/barry-far/V2ray-Config/main/All_Configs_base64_Sub.txt",
-    "https://raw.githubusercontent.com/Epodonios/v2ray-configs/main/All_Configs_Sub.txt",
-    "https://raw.githubusercontent.com/Epodonios/v2ray-configs/main/All_Configs_base64_Sub.txt",
-    "https://raw.githubusercontent.com/MatinGhanbari/v2ray-configs/main/subscriptions/v2ray/all_sub.txt",
-    "https://raw.githubusercontent.com/MatinGhanbari/v2ray-configs/main/subscriptions/v2ray/super-sub.txt",
-    "https://raw.githubusercontent.com/sevcator/5ubscrpt10n/main/sub/vless+vmess+trojan+ss.txt",
-    "https://raw.githubusercontent.com/SoliSpirit/v2ray-configs/main/all_configs.txt",
-    "https://raw.githubusercontent.com/ebrasha/free-v2ray-public-list/main/all_extracted_configs.txt",
-    "https://raw.githubusercontent.com/ninjastrikers/v2ray-configs/main/combined/all.txt",
-    "https://raw.githubusercontent.com/zipvpn/FreeVPNNodes/main/free_v2ray_xray_nodes.txt",
-]
-
 ITEMS_PER_PAGE = 8
-UPDATE_INTERVAL_MIN = 30
 FASTEST_CACHE_TTL = 900
-PING_CACHE_TTL = 600
-MAX_CONCURRENT_PINGS = 15
-
-user_configs: Dict[int, List[str]] = {}
-user_ping_cache: Dict[int, Dict[str, tuple[float, float | None]]] = {}
-sorted_by_ping_cache: Dict[int, tuple[list[str], float]] = {}
-cancel_tasks: Dict[int, asyncio.Task] = {}
-
-def parse_server_address(config: str) -> tuple[str, int] | None:
-    if not config.startswith(("vmess://", "vless://", "trojan://", "ss://")):
+FIRST_PAGE_DEADLINE = 2.0
+RANKING_REFRESH_INTERVAL = 3.0
+PREFETCH_PAGES = 2
+BOT_API_RATE = 25
+EDIT_MIN_INTERVAL = 1.0
+EXPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SESSION_IDLE_TTL = 6 * 3600
+SESSION_MAX_BYTES = 64 * 1024 * 1024
+STATE_PATH = os.getenv("STATE_PATH", "state.sqlite3")
+CHECKPOINT_INTERVAL = 300
+
+bot.session.middleware(ThrottleMiddleware(RateLimiter(rate=BOT_API_RATE / WORKERS if BOT_ROLE == "worker" else BOT_API_RATE)))
+message_editor = MessageEditor(min_interval=EDIT_MIN_INTERVAL)
+export_cache = ExportCache(max_bytes=EXPORT_CACHE_MAX_BYTES)
+dns_cache = DnsCache(ttl=DNS_CACHE_TTL, negative_ttl=DNS_NEGATIVE_TTL)
+country_classifier = CountryClassifier(GEOIP_DB, resolver=dns_cache, hints=COUNTRIES)
+config_pool = ConfigPool(
+    SOURCES,
+    refresh_interval=UPDATE_INTERVAL_MIN * 60,
+    countries=COUNTRIES,
+    fetch_on_demand=BOT_ROLE != "worker",
+    classify=country_classifier,
+)
+probe_scheduler = ProbeScheduler(
+    max_inflight=MAX_INFLIGHT_PROBES,
+    probe=partial(measure_tcp_ping, timeout=PROBE_TIMEOUT, resolver=dns_cache),
+)
+latency_cache = LatencyCache(
+    ttl=PING_CACHE_TTL,
+    max_size=PING_CACHE_MAX_ENDPOINTS,
+    probe=probe_scheduler.submit,
+    promote=probe_scheduler.promote,
+)
+probe_pool = ProbePool(
+    PROBE_PROCESSES,
+    concurrency=PROBE_POOL_CONCURRENCY,
+    rate=PROBE_POOL_RATE,
+    timeout=PROBE_TIMEOUT,
+) if PROBE_PROCESSES > 0 and BOT_ROLE != "worker" else None
+health_prober = HealthProber(
+    config_pool,
+    latency_cache,
+    rate=PROBE_POOL_RATE if probe_pool else PROBE_RATE,
+    min_interval=PROBE_MIN_INTERVAL,
+    resolver=dns_cache,
+    engine=probe_pool,
+)
+config_pool.schedule.reachable = health_prober.reachable
+checkpointer = Checkpointer(
+    STATE_PATH,
+    config_pool,
+    health_prober,
+    latency_cache,
+    interval=SHARE_INTERVAL if BOT_ROLE == "coordinator" else CHECKPOINT_INTERVAL,
+)
+
+sessions = SessionStore(ttl=SESSION_IDLE_TTL, max_bytes=SESSION_MAX_BYTES)
+user_jobs = UserJobs()
+ranking_jobs = SingleFlight()
+page_fills: Dict[tuple[int, int], asyncio.Task] = {}
+prefetch_tasks: set[asyncio.Task] = set()
+checkpoint_saves: set[asyncio.Task] = set()
+geoip_passes: set[asyncio.Task] = set()
+
+async def get_latency(config: ConfigRecord, user_id: Optional[int] = None, priority: int = INTERACTIVE) -> float | None:
+    addr = config.address
+    if not addr:
         return None
-    try:
-        encoded_part = config.split("://", 1)[1].split("#")[0].split("?")[0].strip()
-        
-        if "@" in encoded_part:
-            encoded_part = encoded_part.split("@")[-1]
-        
-        if ":" in encoded_part and encoded_part.count(":") >= 1:
-            host_port = encoded_part.rsplit(":", 1)
-            if host_port[1].isdigit():
-                return host_port[0].strip(), int(host_port[1])
-        
-        decoded = base64.urlsafe_b64decode(encoded_part + "==" * 2).decode("utf-8", errors="ignore")
-        data = json.loads(decoded)
-        
-        add = data.get("add") or data.get("address") or data.get("host")
-        port = data.get("port")
-        
-        if add and port and isinstance(port, (int, str)) and str(port).isdigit():
-            return str(add).strip(), int(port)
-            
-    except Exception:
-        pass
-    
-    try:
-        if "://" in config:
-            after = config.split("://", 1)[1]
-            if ":" in after:
-                parts = after.rsplit(":", 1)
-                if len(parts) == 2 and parts[1].split("#")[0].strip().isdigit():
-                    return parts[0].strip(), int(parts[1].split("#")[0].strip())
-    except:
-        pass
-        
-    return None
+    health_prober.touch(*addr)
+    return await latency_cache.get(*addr, owner=user_id, priority=priority)
 
-async def measure_tcp_ping(host: str, port: int, timeout: float = 3.0) -> float | None:
-    try:
-        start = time.time()
-        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
-        writer.close()
-        await writer.wait_closed()
-        return round((time.time() - start) * 1000, 1)
-    except:
-        return None
+async def get_ping(config: ConfigRecord, user_id: Optional[int] = None, priority: int = INTERACTIVE) -> str:
+    return describe_latency(config, await get_latency(config, user_id, priority))
 
-async def get_ping(user_id: int, config: str) -> str:
-    key = config[:100]
-    now = time.time()
-    cache = user_ping_cache.get(user_id, {})
-    if key in cache:
-        ts, val = cache[key]
-        if now - ts < PING_CACHE_TTL:
-            return f"{val:.1f}ms" if val is not None else "❌"
-    addr = parse_server_address(config)
-    if not addr:
-        ping_val = None
-    else:
-        ping_val = await measure_tcp_ping(*addr)
-    if user_id not in user_ping_cache:
-        user_ping_cache[user_id] = {}
-    user_ping_cache[user_id][key] = (now, ping_val)
+def format_ping(ping_val: float | None) -> str:
     return f"{ping_val:.1f}ms" if ping_val is not None else "❌"
 
-def split_configs(text: str) -> list[str]:
-    result = []
-    for line in text.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        if line.startswith(('#', '备注', '备注:', '说明', '备注：', 'سرور', 'Channel', 'Group', '必进', '--------------------------------')):
-            continue
-        if any(line.startswith(p) for p in ['vmess://', 'vless://', 'trojan://', 'ss://', 'ssr://']):
-            result.append(line)
-    return result
-
-async def fetch_url(session: aiohttp.ClientSession, url: str) -> str | None:
-    try:
-        async with session.get(url, timeout=15) as resp:
-            if resp.status == 200:
-                return await resp.text()
-    except:
-        pass
-    return None
+def describe_latency(config: ConfigRecord, ping_val: float | None) -> str:
+    """Пинг по истории проверок (EWMA±джиттер, % успешных), если она есть."""
+    stats = health_prober.stats_for(config)
+    if ping_val is None or stats is None or stats.ewma is None or stats.count < 2:
+        return format_ping(ping_val)
+    text = f"{stats.ewma:.0f}±{stats.jitter:.0f}ms"
+    if stats.success_ratio < 0.95:
+        text += f" {stats.success_ratio:.0%}"
+    return text
+
+def cached_ping(config: ConfigRecord) -> Optional[str]:
+    addr = config.address
+    if not addr:
+        return "❌"
+    entry = latency_cache.peek(*addr)
+    return describe_latency(config, entry[1]) if entry is not None else None
 
 def escape_md_v2(text: str) -> str:
     special_chars = r'_[]()~`>#+-=|{}.!'
@@ -144,16 +193,56 @@ def escape_md_v2(text: str) -> str:
         text = text.replace(char, '\\' + char)
     return text
 
-async def safe_edit(message: Message, text: str, reply_markup=None, parse_mode="MarkdownV2"):
-    try:
-        await message.edit_text(
-            escape_md_v2(text) if parse_mode == "MarkdownV2" else text,
-            reply_markup=reply_markup,
-            parse_mode=parse_mode,
-            disable_web_page_preview=True
-        )
-    except Exception as e:
-        logger.warning(f"Не удалось отредактировать сообщение: {e}")
+def render_label(config: ConfigRecord) -> str:
+    cfg = config.raw
+    return escape_md_v2(cfg[:38] + "…" if len(cfg) > 38 else cfg)
+
+page_cache = PageCache(render_label, ITEMS_PER_PAGE)
+
+profiler = SamplingProfiler() if PROFILE_SLOW_HANDLER_MS > 0 else None
+bot_metrics = BotMetrics(MetricsRegistry(), config_pool, {
+    "handlers": handler_limiter,
+    "ping_cache": latency_cache,
+    "probes": probe_scheduler,
+    "dns": dns_cache,
+    "sessions": sessions,
+    "page_cache": page_cache,
+    "export_cache": export_cache,
+    "editor": message_editor,
+    "checkpoint": checkpointer,
+    "user_jobs": user_jobs,
+    "ranking_jobs": ranking_jobs,
+    "geoip": country_classifier,
+    "sources": config_pool.fetcher,
+    "source_schedule": config_pool.schedule,
+})
+if probe_pool is not None:
+    bot_metrics.components["probe_pool"] = probe_pool
+latency_cache.observers.append(bot_metrics.observe_probe)
+config_pool.observers.append(bot_metrics.observe_refresh)
+handler_metrics = HandlerMetricsMiddleware(bot_metrics.observe_handler, profiler, PROFILE_SLOW_HANDLER_MS)
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+
+def stop_page_fill(message: Message):
+    task = page_fills.pop((message.chat.id, message.message_id), None)
+    if task is not None and not task.done():
+        task.cancel()
+
+async def safe_edit(message: Message, text: str, reply_markup=None, parse_mode="MarkdownV2", wait: bool = True):
+    stop_page_fill(message)
+    await edit_message(message, text, reply_markup, parse_mode, wait)
+
+async def edit_message(message: Message, text: str, reply_markup=None, parse_mode="MarkdownV2", wait: bool = True):
+    ok = await message_editor.edit(
+        message,
+        escape_md_v2(text) if parse_mode == "MarkdownV2" else text,
+        wait=wait,
+        reply_markup=reply_markup,
+        parse_mode=parse_mode,
+        disable_web_page_preview=True
+    )
+    if not ok:
         try:
             await message.answer("⚠ Произошла ошибка при обновлении. Попробуйте /start")
         except:
@@ -170,52 +259,145 @@ async def safe_answer(message: Message, text: str, reply_markup=None, parse_mode
     except Exception as e:
         logger.error(f"Ошибка при отправке сообщения: {e}", exc_info=True)
 
-async def build_config_list_keyboard(page: int, total: int, user_id: int, use_sorted: bool = False) -> InlineKeyboardMarkup:
-    if use_sorted and user_id in sorted_by_ping_cache:
-        configs, ts = sorted_by_ping_cache[user_id]
-        if time.time() - ts > FASTEST_CACHE_TTL:
-            configs = user_configs.get(user_id, [])
-    else:
-        configs = user_configs.get(user_id, [])
+def page_configs(user_id: int, use_sorted: bool = False) -> Sequence[ConfigRecord]:
+    session = sessions.get(user_id)
+    snapshot = config_pool.snapshot
+    if session is None or snapshot is None:
+        return ()
+    if session.version != snapshot.version:
+        session.version = snapshot.version
+        sessions.set_ranking(session, None)
+    if use_sorted:
+        ranked = session.ranking(FASTEST_CACHE_TTL)
+        if ranked is not None:
+            return ranked
+    return snapshot.index.select(protocol=session.protocol, country=session.country)
+
+def is_sorted(user_id: int) -> bool:
+    session = sessions.get(user_id)
+    return session is not None and session.ranking(FASTEST_CACHE_TTL) is not None
+
+def remember_page(user_id: int, page: int):
+    session = sessions.get(user_id)
+    if session is not None:
+        session.page = page
+
+def list_key(user_id: int, use_sorted: bool = False) -> tuple:
+    """Ключ списка для кэша подписей: версия снимка, фильтр и порядок."""
+    session = sessions.get(user_id)
+    if session is None:
+        return ()
+    return (session.version, session.protocol, session.country, use_sorted and session.ranked is not None)
+
+def render_config_list_keyboard(
+    configs: Sequence[ConfigRecord],
+    page: int,
+    pings: Sequence[str],
+    busy: bool = False,
+    key: tuple = (),
+) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     start = page * ITEMS_PER_PAGE
-    end = min(start + ITEMS_PER_PAGE, len(configs))
-    sem = asyncio.Semaphore(MAX_CONCURRENT_PINGS)
-    async def limited_ping(i: int):
-        async with sem:
-            return await get_ping(user_id, configs[i])
-    if end > start:
-        ping_tasks = [limited_ping(i) for i in range(start, end)]
-        pings = await asyncio.gather(*ping_tasks)
-    else:
-        pings = []
-    for i, ping in enumerate(pings, start=start):
-        cfg = configs[i]
-        short = cfg[:38] + "…" if len(cfg) > 38 else cfg
-        short_esc = escape_md_v2(short)
-        builder.button(text=f"[{ping}] {short_esc}", callback_data=f"cfg:{i}:{page}")
+    labels = page_cache.labels((*key, page), page_cache.page_records(configs, page))
+    for i, (label, ping) in enumerate(zip(labels, pings), start=start):
+        builder.button(text=f"[{ping}] {label}", callback_data=f"cfg:{i}:{page}")
     builder.adjust(1)
     nav = []
     if page > 0:
         nav.append(InlineKeyboardButton(text="◀️", callback_data=f"page:{page-1}"))
     pages_total = (len(configs) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
     nav.append(InlineKeyboardButton(text=f"{page+1}/{pages_total}", callback_data="ignore"))
-    if end < len(configs):
+    if start + ITEMS_PER_PAGE < len(configs):
         nav.append(InlineKeyboardButton(text="▶️", callback_data=f"page:{page+1}"))
     builder.row(*nav)
-    builder.row(
-        InlineKeyboardButton(text="⚡ Лучшие (пинг)", callback_data="sort:fastest"),
-        InlineKeyboardButton(text="Скачать этот список", callback_data="dl_menu:current")
-    )
+    if busy:
+        builder.row(InlineKeyboardButton(text="✖ Отменить", callback_data="cancel"))
+    else:
+        builder.row(
+            InlineKeyboardButton(text="⚡ Лучшие (пинг)", callback_data="sort:fastest"),
+            InlineKeyboardButton(text="Скачать этот список", callback_data="dl_menu:current")
+        )
     builder.row(InlineKeyboardButton(text="🏠 Главное меню", callback_data="back_to_main"))
     return builder.as_markup()
 
-def build_download_menu_keyboard(current_mode: str = "all") -> InlineKeyboardMarkup:
+async def build_config_list_keyboard(page: int, total: int, user_id: int, use_sorted: bool = False) -> InlineKeyboardMarkup:
+    configs = page_configs(user_id, use_sorted)
+    remember_page(user_id, page)
+    records = page_cache.page_records(configs, page)
+    pings = await asyncio.gather(*(get_ping(cfg, user_id, INTERACTIVE) for cfg in records))
+    key = list_key(user_id, use_sorted)
+    prefetch_pages(configs, page, user_id, key)
+    return render_config_list_keyboard(configs, page, pings, key=key)
+
+async def show_config_page(
+    message: Message,
+    user_id: int,
+    page: int,
+    text: str,
+    use_sorted: bool = False,
+    wait: bool = True,
+    busy: bool = False,
+):
+    """Перерисовывает страницу списка на месте по кэшу пингов; неизвестные дописываются следующим редактированием.
+
+    ``busy`` — страница ещё идущей операции: вместо действий на ней кнопка отмены.
+    """
+    configs = page_configs(user_id, use_sorted)
+    remember_page(user_id, page)
+    pings = [cached_ping(cfg) for cfg in page_cache.page_records(configs, page)]
+    list_id = list_key(user_id, use_sorted)
+    kb = render_config_list_keyboard(configs, page, [ping or "…" for ping in pings], busy, list_id)
+    stop_page_fill(message)
+    if None in pings:
+        key = (message.chat.id, message.message_id)
+        page_fills[key] = asyncio.create_task(fill_page(message, key, user_id, configs, page, text, busy, list_id))
+    prefetch_pages(configs, page, user_id, list_id)
+    await edit_message(message, text, kb, wait=wait)
+
+async def fill_page(
+    message: Message,
+    key: tuple[int, int],
+    user_id: int,
+    configs: Sequence[ConfigRecord],
+    page: int,
+    text: str,
+    busy: bool = False,
+    list_id: tuple = (),
+):
+    try:
+        records = page_cache.page_records(configs, page)
+        pings = await asyncio.gather(*(get_ping(cfg, user_id, INTERACTIVE) for cfg in records))
+        if page_fills.get(key) is asyncio.current_task():
+            await edit_message(message, text, render_config_list_keyboard(configs, page, pings, busy, list_id))
+    finally:
+        if page_fills.get(key) is asyncio.current_task():
+            del page_fills[key]
+
+def prefetch_pages(configs: Sequence[ConfigRecord], page: int, user_id: int, key: tuple = ()):
+    for ahead in range(page + 1, page + 1 + PREFETCH_PAGES):
+        records = page_cache.page_records(configs, ahead)
+        if not records:
+            break
+        page_cache.labels((*key, ahead), records)
+        for cfg in records:
+            if cfg.address and latency_cache.peek(*cfg.address) is None:
+                task = asyncio.create_task(get_latency(cfg, user_id, BULK))
+                prefetch_tasks.add(task)
+                task.add_done_callback(prefetch_tasks.discard)
+
+def build_download_menu_keyboard(current_mode: str = "all", fmt: str = "txt") -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     for n in (5, 10, 15, 20, 30, 50):
-        builder.button(text=f"{n} шт", callback_data=f"dl:{current_mode}:{n}")
-    builder.button(text="Все", callback_data=f"dl:{current_mode}:all")
+        builder.button(text=f"{n} шт", callback_data=f"dl:{current_mode}:{n}:{fmt}")
+    builder.button(text="Все", callback_data=f"dl:{current_mode}:all:{fmt}")
     builder.adjust(3)
+    builder.row(*[
+        InlineKeyboardButton(
+            text=f"• {FORMAT_LABELS[f]}" if f == fmt else FORMAT_LABELS[f],
+            callback_data=f"dl_menu:{current_mode}:{f}"
+        )
+        for f in FORMATS
+    ])
     builder.row(InlineKeyboardButton(text="← Назад", callback_data="back_to_list"))
     return builder.as_markup()
 
@@ -251,16 +433,20 @@ def get_fastest_count_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 async def show_main_list(obj, user_id: int):
-    if user_id not in user_configs or not user_configs[user_id]:
+    configs = page_configs(user_id)
+    if not configs:
         text = "Конфиги ещё не загружены.\nВыберите действие ниже"
         kb = get_main_menu_keyboard()
     else:
-        total = len(user_configs[user_id])
+        total = len(configs)
         text = (
             f"Найдено конфигов: {total}\n"
             f"Страница 1/{((total + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE)}\n"
             "Пинг — время TCP-подключения"
         )
+        if not isinstance(obj, Message):
+            await show_config_page(obj, user_id, 0, text)
+            return
         kb = await build_config_list_keyboard(0, total, user_id)
     if isinstance(obj, Message):
         await safe_answer(obj, text, kb)
@@ -270,10 +456,11 @@ async def show_main_list(obj, user_id: int):
 @router.message(Command("start", "help"))
 async def cmd_start(message: Message):
     user_id = message.from_user.id
-    if user_id in user_configs and user_configs[user_id]:
-        total = len(user_configs[user_id])
+    configs = page_configs(user_id, use_sorted=True)
+    if configs:
+        total = len(configs)
         text = f"Конфиги уже загружены ({total} шт)\nВыберите действие:"
-        kb = await build_config_list_keyboard(0, total, user_id, use_sorted=user_id in sorted_by_ping_cache)
+        kb = await build_config_list_keyboard(0, total, user_id, use_sorted=True)
     else:
         text = (
             "Бот раздаёт бесплатные VLESS / VMess / Trojan конфиги\n\n"
@@ -287,33 +474,23 @@ async def load_and_show_configs(
     user_id: int,
     is_fastest: bool = False,
     country: Optional[str] = None,
-    ping_count: Optional[int] = None
+    protocol: Optional[str] = None,
+    ping_count: Optional[int | str] = None
 ):
     if isinstance(obj, Message):
         sent = await obj.answer("Собираю конфиги...")
     else:
         sent = await obj.edit_text("Собираю конфиги с серверов...")
-    configs = []
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch_url(session, url) for url in SOURCES]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        for res in results:
-            if isinstance(res, str):
-                configs.extend(split_configs(res))
-    if not configs:
+    snapshot = await config_pool.get()
+    if not snapshot:
         await safe_edit(sent, "Не удалось загрузить конфиги 😔")
         return
-    if country:
-        country = country.lower()
-        filtered = [c for c in configs if country in (c.split("#")[-1].lower() if "#" in c else "")]
-        configs = filtered
+    configs = snapshot.index.select(protocol=protocol, country=country)
     if not configs:
         msg = f"Конфигов с '{country.upper()}' не найдено" if country else "Конфигов не найдено"
         await safe_edit(sent, msg)
         return
-    user_configs[user_id] = configs
-    user_ping_cache.pop(user_id, None)
-    sorted_by_ping_cache.pop(user_id, None)
+    sessions.open(user_id, snapshot.version, protocol=protocol, country=country)
     if is_fastest:
         if ping_count is None:
             await safe_edit(
@@ -323,65 +500,82 @@ async def load_and_show_configs(
             )
             return
         else:
-            await safe_edit(
-                sent,
-                f"Пингую {ping_count if ping_count != 'all' else 'все'} серверов...\nЭто может занять время",
-                None
-            )
             await sort_by_ping(user_id, sent, limit=ping_count if ping_count != 'all' else None)
     else:
         await show_main_list(sent, user_id)
 
 async def sort_by_ping(user_id: int, message_to_edit: Message, limit: Optional[int] = None):
-    configs = user_configs.get(user_id, [])
-    if not configs:
+    session = sessions.get(user_id)
+    configs = page_configs(user_id)
+    if not configs or session is None:
         await safe_edit(message_to_edit, "Нет конфигов для сортировки")
         return
-    if limit is not None and isinstance(limit, int):
-        configs = configs[:limit]
-        text_limit = f" (первые {limit} из {len(user_configs[user_id])})"
-    else:
-        text_limit = ""
-    total = len(configs)
-    processed = 0
-    sem = asyncio.Semaphore(MAX_CONCURRENT_PINGS)
-    async def limited_ping(cfg: str):
-        nonlocal processed
-        async with sem:
-            p = await get_ping(user_id, cfg)
-            processed += 1
-            if processed % 10 == 0 or processed == total:
-                perc = round(processed / total * 100)
-                try:
-                    await safe_edit(
-                        message_to_edit,
-                        f"Пингую {processed}/{total} ({perc}%){text_limit}",
-                        message_to_edit.reply_markup
-                    )
-                except:
-                    pass
-            return p
-    ping_tasks = [limited_ping(cfg) for cfg in configs]
-    pings_str = await asyncio.gather(*ping_tasks, return_exceptions=True)
-    ping_values = []
-    for p in pings_str:
-        if isinstance(p, Exception) or p == "❌":
-            ping_values.append(99999)
-        else:
-            try:
-                ping_values.append(float(str(p).rstrip("ms")))
-            except:
-                ping_values.append(99999)
-    sorted_indices = sorted(range(len(configs)), key=lambda i: ping_values[i])
-    sorted_configs = [configs[i] for i in sorted_indices]
-    sorted_by_ping_cache[user_id] = (sorted_configs, time.time())
+    if limit is not None and not isinstance(limit, int):
+        limit = None
+    ranked = health_prober.rank(configs, limit)
+    if ranked is not None:
+        text_limit = f" ({limit} лучших из {len(configs)})" if limit is not None else ""
+        await show_sorted(user_id, message_to_edit, ranked, text_limit)
+        return
+    await safe_edit(
+        message_to_edit,
+        f"Пингую {limit if limit is not None else 'все'} серверов...\nЭто может занять время",
+        InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✖ Отменить", callback_data="cancel")]])
+    )
+    text_limit = f" ({limit} лучших из {len(configs)})" if limit is not None else ""
+
+    async def show_progress(ranked: tuple[ConfigRecord, ...], processed: int, total: int):
+        status = f"Пингую {processed}/{total} ({round(processed / total * 100)}%)"
+        await show_sorted(user_id, message_to_edit, ranked, text_limit, status)
+
+    # Задача общая для всех с тем же фильтром: она публикует один кортеж,
+    # и каждая сессия хранит ссылку на него, а не свою копию.
+    async def rank(job: SharedJob) -> tuple[ConfigRecord, ...]:
+        async def probe(cfg: ConfigRecord) -> float | None:
+            value = await get_latency(cfg, user_id, BULK)
+            if value is None:
+                return None
+            score = health_prober.score_for(cfg)
+            return score if score != math.inf else value
+
+        ranker = StreamingRanker(
+            probe,
+            k=limit if limit is not None else len(configs),
+            confident_ms=CONFIDENT_PING_MS if limit is not None else None,
+            first_deadline=FIRST_PAGE_DEADLINE,
+            refresh_interval=RANKING_REFRESH_INTERVAL,
+            on_update=lambda r: ranking_jobs.notify(job, tuple(r.ranked()), r.processed, r.total),
+        )
+        order = sorted(configs, key=health_prober.score_for)
+        await dns_cache.prefetch(cfg.host for cfg in order if cfg.address)
+        sorted_configs = await ranker.run(order)
+        if limit is None:
+            ranked = set(map(id, sorted_configs))
+            sorted_configs += [cfg for cfg in configs if id(cfg) not in ranked]
+        return tuple(sorted_configs)
+
+    key = (session.version, session.protocol, session.country, limit)
+    sorted_configs = await ranking_jobs.run(key, rank, listener=show_progress)
+    await show_sorted(user_id, message_to_edit, sorted_configs, text_limit)
+
+async def show_sorted(
+    user_id: int,
+    message_to_edit: Message,
+    sorted_configs: tuple[ConfigRecord, ...],
+    text_limit: str,
+    status: str = "",
+):
+    session = sessions.get(user_id)
+    if session is not None:
+        sessions.set_ranking(session, sorted_configs)
     text = (
         f"Отсортировано по пингу (лучшие первые){text_limit}\n"
         f"Показано: {len(sorted_configs)} конфигов\n"
         f"Страница 1/{((len(sorted_configs) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE)}"
     )
-    kb = await build_config_list_keyboard(0, len(sorted_configs), user_id, use_sorted=True)
-    await safe_edit(message_to_edit, text, kb)
+    if status:
+        text += f"\n{status}"
+    await show_config_page(message_to_edit, user_id, 0, text, use_sorted=True, wait=not status, busy=bool(status))
 
 @router.callback_query(F.data.startswith("get:"))
 async def handle_get_action(callback: CallbackQuery):
@@ -389,22 +583,31 @@ async def handle_get_action(callback: CallbackQuery):
     user_id = callback.from_user.id
     is_fastest = action == "fastest"
     country = None
-    is_vless = action == "vless"
+    protocol = "vless" if action == "vless" else None
     if action not in ("all", "fastest", "vless"):
         country = action
-    await load_and_show_configs(callback.message, user_id, is_fastest=is_fastest, country=country)
+    await user_jobs.run(
+        user_id,
+        ("get", action),
+        lambda: load_and_show_configs(callback.message, user_id, is_fastest=is_fastest, country=country, protocol=protocol),
+    )
     await callback.answer()
 
 @router.callback_query(F.data.startswith("fastest:"))
 async def handle_fastest_count(callback: CallbackQuery):
     user_id = callback.from_user.id
     arg = callback.data.split(":", 1)[1]
-    count = None if arg == "all" else int(arg)
-    await load_and_show_configs(callback.message, user_id, is_fastest=True, ping_count=count)
+    count = "all" if arg == "all" else int(arg)
+    await user_jobs.run(
+        user_id,
+        ("fastest", count),
+        lambda: load_and_show_configs(callback.message, user_id, is_fastest=True, ping_count=count),
+    )
     await callback.answer()
 
 @router.callback_query(F.data == "back_to_main")
 async def back_to_main(callback: CallbackQuery):
+    user_jobs.cancel(callback.from_user.id)
     await safe_edit(
         callback.message,
         "Выбери действие:",
@@ -433,14 +636,11 @@ async def handle_clients(callback: CallbackQuery):
 @router.callback_query(F.data == "cancel")
 async def handle_cancel_inline(callback: CallbackQuery):
     uid = callback.from_user.id
-    if uid in cancel_tasks and not cancel_tasks[uid].done():
-        cancel_tasks[uid].cancel()
-    user_configs.pop(uid, None)
-    user_ping_cache.pop(uid, None)
-    sorted_by_ping_cache.pop(uid, None)
+    cancelled = user_jobs.cancel(uid)
+    sessions.drop(uid)
     await safe_edit(
         callback.message,
-        "Сессия очищена.\nЧто дальше?",
+        ("Операция отменена. " if cancelled else "") + "Сессия очищена.\nЧто дальше?",
         get_main_menu_keyboard()
     )
     await callback.answer()
@@ -448,40 +648,40 @@ async def handle_cancel_inline(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("dl_menu:"))
 async def show_download_menu_filtered(callback: CallbackQuery):
     user_id = callback.from_user.id
-    mode = callback.data.split(":", 1)[1]
-    if user_id not in user_configs:
+    _, mode, *rest = callback.data.split(":")
+    fmt = rest[0] if rest and rest[0] in FORMATS else "txt"
+    if user_id not in sessions:
         await callback.answer("Сначала загрузите конфиги", show_alert=True)
         return
-    text = f"Сколько конфигов скачать ({mode.upper()}):"
-    if mode == "fastest" and user_id not in sorted_by_ping_cache:
+    text = f"Сколько конфигов скачать ({mode.upper()}, {FORMAT_LABELS[fmt]}):"
+    if mode == "fastest" and not is_sorted(user_id):
         text += "\n(список fastest ещё не отсортирован — будет отсортирован сейчас)"
-    await safe_edit(callback.message, text, build_download_menu_keyboard(current_mode=mode))
+    await safe_edit(callback.message, text, build_download_menu_keyboard(current_mode=mode, fmt=fmt))
     await callback.answer()
 
 @router.callback_query(F.data.startswith("dl:"))
 async def handle_download(callback: CallbackQuery):
     user_id = callback.from_user.id
-    if user_id not in user_configs:
+    if user_id not in sessions:
         await callback.answer("Нет конфигов в сессии", show_alert=True)
         return
     try:
-        _, mode, arg = callback.data.split(":")
+        _, mode, arg, *rest = callback.data.split(":")
     except:
         await callback.answer("Ошибка формата", show_alert=True)
         return
+    fmt = rest[0] if rest and rest[0] in FORMATS else "txt"
     if mode == "current":
-        configs = user_configs[user_id]
-        if user_id in sorted_by_ping_cache:
-            configs, _ = sorted_by_ping_cache[user_id]
+        configs = page_configs(user_id, use_sorted=True)
     elif mode == "fastest":
-        if user_id not in sorted_by_ping_cache:
-            await sort_by_ping(user_id, callback.message)
-        configs, _ = sorted_by_ping_cache[user_id]
-    elif mode in ("ru", "de", "us", "pl", "fr", "nl"):
-        country = mode.lower()
-        configs = [c for c in user_configs[user_id] if country in (c.split("#")[-1].lower() if "#" in c else "")]
+        if not is_sorted(user_id):
+            await user_jobs.run(user_id, ("sort", None), lambda: sort_by_ping(user_id, callback.message))
+        configs = page_configs(user_id, use_sorted=True)
+    elif mode in COUNTRIES:
+        snapshot = config_pool.snapshot
+        configs = snapshot.index.filter(page_configs(user_id), mode) if snapshot else []
     else:
-        configs = user_configs[user_id]
+        configs = page_configs(user_id)
     if arg == "all":
         selected = configs
     else:
@@ -492,52 +692,65 @@ async def handle_download(callback: CallbackQuery):
     if not selected:
         await callback.answer("Нечего скачивать", show_alert=True)
         return
-    path = f"configs_{user_id}_{mode}.txt"
-    with open(path, "w", encoding="utf-8") as f:
-        f.write("\n".join(selected))
-    caption = f"Скачано {len(selected)} конфигов ({mode.upper()})"
+    snapshot = config_pool.snapshot
+    artifact = await export_cache.get(snapshot.version if snapshot else 0, selected, fmt, f"{mode}_{arg}")
+    caption = f"Скачано {len(selected)} конфигов ({mode.upper()}, {FORMAT_LABELS[fmt]})"
     try:
-        await callback.message.answer_document(
-            FSInputFile(path),
-            caption=caption
-        )
+        await send_artifact(callback.message, artifact, caption)
     except Exception as e:
         logger.error(f"Ошибка отправки файла: {e}")
         await callback.message.answer("Не удалось отправить файл 😔")
-    try:
-        os.remove(path)
-    except:
-        pass
     await callback.answer()
 
+async def send_artifact(message: Message, artifact: Artifact, caption: str):
+    """Повторные отправки идут по file_id без блокировки; lock только на время первой загрузки."""
+    file_id = artifact.file_id
+    if file_id is not None:
+        try:
+            await message.answer_document(file_id, caption=caption)
+            return
+        except TelegramBadRequest:
+            if artifact.file_id == file_id:
+                artifact.file_id = None
+    async with artifact.lock:
+        file_id = artifact.file_id
+        if file_id is None:
+            sent = await message.answer_document(
+                BufferedInputFile(artifact.data, filename=artifact.filename),
+                caption=caption
+            )
+            if sent.document:
+                artifact.file_id = sent.document.file_id
+            return
+    await message.answer_document(file_id, caption=caption)
+
 @router.callback_query(F.data.startswith("page:"))
 async def handle_page(callback: CallbackQuery):
     uid = callback.from_user.id
-    if uid not in user_configs:
+    if uid not in sessions:
         await callback.answer("Сессия устарела. Нажмите /start", show_alert=True)
         return
     try:
         page = int(callback.data.split(":")[1])
     except:
         return
-    total = len(user_configs[uid])
+    total = len(page_configs(uid, use_sorted=True))
     max_page = (total + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
     if page < 0 or page >= max_page:
+        await callback.answer()
         return
-    use_sorted = uid in sorted_by_ping_cache
-    kb = await build_config_list_keyboard(page, total, uid, use_sorted=use_sorted)
     text = (
         f"Найдено {total} конфигов\n"
         f"Страница {page+1}/{max_page}\n"
         "Пинг — время TCP-подключения"
     )
-    await safe_edit(callback.message, text, kb)
     await callback.answer()
+    await show_config_page(callback.message, uid, page, text, use_sorted=True)
 
 @router.callback_query(F.data.startswith("cfg:"))
 async def show_one_config(callback: CallbackQuery):
     user_id = callback.from_user.id
-    if user_id not in user_configs:
+    if user_id not in sessions:
         await callback.answer("Сессия устарела", show_alert=True)
         return
     try:
@@ -547,12 +760,21 @@ async def show_one_config(callback: CallbackQuery):
     except:
         await callback.answer()
         return
-    configs = user_configs[user_id]
+    configs = page_configs(user_id, use_sorted=True)
     if idx >= len(configs):
         await callback.answer()
         return
-    cfg = configs[idx]
-    ping = await get_ping(user_id, cfg)
+    cfg = configs[idx].raw
+    ping = format_ping(await get_latency(configs[idx], user_id))
+    dns = dns_cache.peek(configs[idx].host) if configs[idx].address else None
+    if dns and dns[0] and ping != "❌":
+        ping += f" (DNS {dns[1]:.1f}ms)"
+    stats = health_prober.stats_for(configs[idx])
+    if stats is not None and stats.ewma is not None:
+        ping += (
+            f"\nСредний: {stats.ewma:.1f}ms, джиттер {stats.jitter:.1f}ms, "
+            f"успешных {stats.success_ratio:.0%} из {stats.count} проверок"
+        )
     builder = InlineKeyboardBuilder()
     builder.button(text="← Назад к списку", callback_data=f"page:{page}")
     builder.row(InlineKeyboardButton(text="🏠 Главное меню", callback_data="back_to_main"))
@@ -572,49 +794,132 @@ async def show_one_config(callback: CallbackQuery):
 @router.callback_query(F.data == "back_to_list")
 async def back_to_list(callback: CallbackQuery):
     user_id = callback.from_user.id
-    if user_id not in user_configs:
+    if user_id not in sessions:
         await callback.answer("Сессия устарела", show_alert=True)
         return
-    total = len(user_configs[user_id])
-    use_sorted = user_id in sorted_by_ping_cache
-    kb = await build_config_list_keyboard(0, total, user_id, use_sorted=use_sorted)
+    total = len(page_configs(user_id, use_sorted=True))
+    pages_total = (total + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
+    page = min(sessions.get(user_id).page, max(pages_total - 1, 0))
     text = (
         f"Найдено {total} конфигов\n"
-        f"Страница 1/{((total + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE)}\n"
+        f"Страница {page+1}/{pages_total}\n"
         "Пинг — время TCP-подключения"
     )
-    await safe_edit(callback.message, text, kb)
     await callback.answer()
+    await show_config_page(callback.message, user_id, page, text, use_sorted=True)
 
 @router.callback_query(F.data == "sort:fastest")
 async def handle_sort_fastest(callback: CallbackQuery):
     uid = callback.from_user.id
-    if uid not in user_configs:
+    if uid not in sessions:
         await callback.answer("Сессия устарела. Используйте /start", show_alert=True)
         return
-    await load_and_show_configs(callback.message, uid, is_fastest=True)
+    await user_jobs.run(uid, ("get", "fastest"), lambda: load_and_show_configs(callback.message, uid, is_fastest=True))
     await callback.answer()
 
-async def auto_update_configs():
-    while True:
-        await asyncio.sleep(UPDATE_INTERVAL_MIN * 60)
-        new_configs = []
-        async with aiohttp.ClientSession() as session:
-            results = await asyncio.gather(*[fetch_url(session, u) for u in SOURCES], return_exceptions=True)
-            for r in results:
-                if isinstance(r, str):
-                    new_configs.extend(split_configs(r))
-        if new_configs:
-            logger.info(f"Обновлены конфиги: {len(new_configs)} строк")
-            for uid in list(user_configs.keys()):
-                user_configs[uid] = new_configs[:]
-                user_ping_cache.pop(uid, None)
-                sorted_by_ping_cache.pop(uid, None)
+def start_metrics(port: int) -> list[asyncio.Task]:
+    if port <= 0:
+        return []
+    if profiler is not None:
+        profiler.start()
+    return [
+        asyncio.create_task(serve_metrics(bot_metrics.registry, METRICS_HOST, port, profiler)),
+        asyncio.create_task(bot_metrics.loop.run()),
+    ]
+
+async def shutdown(background: list[asyncio.Task], save: bool = True):
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    if probe_pool is not None:
+        await probe_pool.close()
+    if not await handler_limiter.drain(DRAIN_TIMEOUT):
+        logger.warning(f"Не все обработчики завершились за {DRAIN_TIMEOUT}s: {handler_limiter.stats()}")
+    left = await probe_scheduler.drain(DRAIN_TIMEOUT)
+    if left:
+        logger.warning(f"Остановка с {left} незавершёнными проверками")
+    if save:
+        await checkpointer.save(force=True)
+    if profiler is not None:
+        profiler.stop()
+    await bot.session.close()
+
+def share_snapshot():
+    """Сохраняет состояние для воркеров в фоне, держа ссылку на задачу до её завершения."""
+    task = asyncio.create_task(checkpointer.save())
+    checkpoint_saves.add(task)
+    task.add_done_callback(checkpoint_saved)
+
+def checkpoint_saved(task: asyncio.Task):
+    checkpoint_saves.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Не удалось сохранить состояние для воркеров: {task.exception()}", exc_info=task.exception())
+
+def classify_snapshot(snapshot: Snapshot):
+    """Снимок строится до того, как DNS разрешит имена хостов: страны по GeoIP уточняются в фоне."""
+    task = asyncio.create_task(reclassify_by_geoip(snapshot))
+    geoip_passes.add(task)
+    task.add_done_callback(geoip_pass_done)
+
+async def reclassify_by_geoip(snapshot: Snapshot):
+    if await country_classifier.warm(snapshot.records):
+        await config_pool.reclassify(snapshot.version)
+
+def geoip_pass_done(task: asyncio.Task):
+    geoip_passes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Не удалось уточнить страны по GeoIP: {task.exception()}", exc_info=task.exception())
+
+async def run_coordinator():
+    cluster = Cluster(WORKERS, WORKER_BASE_PORT, WEBHOOK_PATH, secret=WEBHOOK_SECRET)
+    bot_metrics.components["cluster"] = cluster
+    config_pool.subscribe(lambda snapshot: share_snapshot())
+    await checkpointer.save()
+    await cluster.start()
+    try:
+        await serve(cluster.app(), WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, bot, WEBHOOK_URL, WEBHOOK_SECRET)
+    finally:
+        await cluster.stop()
+
+async def run_worker():
+    await checkpointer.sync()
+    background = [asyncio.create_task(checkpointer.follow(FOLLOW_INTERVAL))]
+    if METRICS_PORT > 0:
+        background += start_metrics(METRICS_PORT + 1 + int(os.getenv("WORKER_INDEX", "0")))
+    try:
+        await run_webhook(dp, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH)
+    finally:
+        await shutdown(background, save=False)
 
 async def main():
-    await bot.delete_webhook(drop_pending_updates=True)
-    asyncio.create_task(auto_update_configs())
-    await dp.start_polling(bot)
+    if BOT_ROLE == "worker":
+        await run_worker()
+        return
+    config_pool.subscribe(classify_snapshot)
+    await checkpointer.restore()
+    background = [
+        asyncio.create_task(config_pool.run()),
+        asyncio.create_task(health_prober.run()),
+        asyncio.create_task(checkpointer.run()),
+        *start_metrics(METRICS_PORT),
+    ]
+    try:
+        if BOT_ROLE == "coordinator":
+            await run_coordinator()
+        elif BOT_MODE == "webhook":
+            await run_webhook(
+                dp, bot,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                public_url=WEBHOOK_URL,
+                secret=WEBHOOK_SECRET,
+            )
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        await shutdown(background)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
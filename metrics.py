@@ -0,0 +1,355 @@
+import asyncio
+import bisect
+import logging
+import math
+import sys
+import threading
+import time
+from collections import Counter as Tally, deque
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from aiohttp import web
+
+from sources import RefreshReport
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONNECT_MS_BUCKETS = (10, 25, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+MAX_PROFILE_SECONDS = 300.0
+
+Family = tuple[str, str, str, List[tuple[Dict[str, str], float]]]
+
+
+def _format_labels(labels: Iterable[tuple[str, str]]) -> str:
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    __slots__ = ("name", "help", "label_names", "buckets", "_series")
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            labels = tuple(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Counter:
+    __slots__ = ("name", "help", "label_names", "_values")
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(zip(self.label_names, label_values))} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Instruments updated on the hot path plus collectors read at scrape time.
+
+    A collector returns families ``(name, type, help, [(labels, value), ...])``,
+    usually built from a component's ``stats()``, so nothing is counted twice.
+    """
+
+    def __init__(self, prefix: str = "bot"):
+        self.prefix = prefix
+        self._instruments: List[Histogram | Counter] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        instrument = Histogram(f"{self.prefix}_{name}", help, label_names, buckets)
+        self._instruments.append(instrument)
+        return instrument
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        instrument = Counter(f"{self.prefix}_{name}", help, label_names)
+        self._instruments.append(instrument)
+        return instrument
+
+    def collector(self, collect: Callable[[], Iterable[Family]]) -> None:
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for instrument in self._instruments:
+            lines.extend(instrument.render())
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрик: {e}", exc_info=True)
+                continue
+            for name, kind, help, samples in families:
+                full = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full} {help}")
+                lines.append(f"# TYPE {full} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{full}{_format_labels(labels.items())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class LoopMonitor:
+    """Measures event-loop lag: how late a ``sleep(interval)`` wakes up."""
+
+    def __init__(self, histogram: Histogram, interval: float = 0.5):
+        self.histogram = histogram
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+
+    async def run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self.last = lag
+            self.max = max(self.max, lag)
+            self.histogram.observe(lag)
+
+
+class SamplingProfiler:
+    """Samples the event-loop thread's stack from a helper thread.
+
+    Keeps the last ``window`` seconds of samples; ``top`` summarises what the
+    loop was doing between two moments (used for slow handlers) and
+    ``collapsed`` renders them in the folded format flame graph tools read.
+    """
+
+    def __init__(self, interval: float = 0.005, window: float = 60.0):
+        self.interval = interval
+        self.window = window
+        self._samples: deque[tuple[float, tuple[str, ...]]] = deque()
+        self._thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            now = time.monotonic()
+            self._samples.append((now, tuple(reversed(stack))))
+            while self._samples and self._samples[0][0] < now - self.window:
+                self._samples.popleft()
+
+    def _between(self, since: float, until: float) -> Tally:
+        return Tally(stack for at, stack in list(self._samples) if since <= at <= until)
+
+    def top(self, since: float, until: float, limit: int = 5) -> List[tuple[str, int]]:
+        stacks = self._between(since, until)
+        return [(" <- ".join(reversed(stack[-4:])), n) for stack, n in stacks.most_common(limit)]
+
+    def collapsed(self, seconds: float) -> str:
+        now = time.monotonic()
+        stacks = self._between(now - seconds, now)
+        return "".join(f"{';'.join(stack)} {n}\n" for stack, n in stacks.most_common())
+
+
+class BotMetrics:
+    """The bot's instruments and the collectors over its components' ``stats()``.
+
+    ``components`` maps a metric group name to any object with ``stats()``;
+    their numeric fields (see ``_stats_samples``) become gauges, so new
+    counters on a component show up without touching this class.
+    """
+
+    def __init__(self, registry: MetricsRegistry, pool, components: Dict[str, object]):
+        self.registry = registry
+        self.pool = pool
+        self.components = components
+        self.handler_seconds = registry.histogram(
+            "handler_seconds", "Update handling time by handler (callback prefix or command).", ("handler",)
+        )
+        self.fetch_seconds = registry.histogram("source_fetch_seconds", "Source fetch duration.", ("source",))
+        self.fetch_bytes = registry.counter("source_fetch_bytes_total", "Bytes downloaded per source.", ("source",))
+        self.fetches = registry.counter("source_fetches_total", "Source fetches by result.", ("source", "result"))
+        self.probe_ms = registry.histogram(
+            "probe_connect_ms", "TCP connect time of successful probes, ms.", buckets=CONNECT_MS_BUCKETS
+        )
+        self.probes = registry.counter("probes_total", "Probes by result.", ("result",))
+        self.loop_lag = registry.histogram("event_loop_lag_seconds", "Event-loop wake-up delay.", buckets=LAG_BUCKETS)
+        self.loop = LoopMonitor(self.loop_lag)
+        registry.collector(self._collect)
+
+    def observe_handler(self, handler: str, seconds: float) -> None:
+        self.handler_seconds.observe(seconds, handler)
+
+    def observe_probe(self, endpoint: tuple[str, int], value: Optional[float]) -> None:
+        if value is None:
+            self.probes.inc(1, "failed")
+        else:
+            self.probes.inc(1, "ok")
+            self.probe_ms.observe(value)
+
+    def observe_refresh(self, report: RefreshReport) -> None:
+        for result, urls in (("changed", report.changed), ("unchanged", report.unchanged), ("failed", report.failed)):
+            for url in urls:
+                state = self.pool.fetcher.states[url]
+                self.fetch_seconds.observe(state.last_duration, url)
+                self.fetch_bytes.inc(state.last_bytes, url)
+                self.fetches.inc(1, url, result)
+
+    def _collect(self) -> Iterable[Family]:
+        snapshot = self.pool.snapshot
+        yield "snapshot_configs", "gauge", "Configs in the current snapshot.", [({}, len(snapshot) if snapshot else 0)]
+        yield "snapshot_version", "gauge", "Current snapshot version.", [({}, snapshot.version if snapshot else 0)]
+        yield "event_loop_lag_max_seconds", "gauge", "Worst event-loop lag since start.", [({}, self.loop.max)]
+        for group, component in self.components.items():
+            for key, values in _stats_samples(component.stats()).items():
+                yield f"{group}_{key}", "gauge", f"{group} {key} (from stats()).", values
+
+
+# Fields that name a row of a stats() list rather than measure anything.
+_ROW_LABELS = {"url": "source", "index": "index"}
+_ROW_SKIP = {"url", "index", "pid"}
+
+
+def _number(value) -> Optional[float]:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    return None
+
+
+def _row_labels(row: dict, position: int) -> Dict[str, str]:
+    labels = {label: str(row[field]) for field, label in _ROW_LABELS.items() if field in row}
+    return labels or {"index": str(position)}
+
+
+def _stats_samples(stats) -> Dict[str, List[tuple[Dict[str, str], float]]]:
+    """Numeric fields of a ``stats()`` result as gauge samples.
+
+    Nested dicts become a ``name`` label; lists of dicts (per source, per
+    process) are labelled by their ``url`` or ``index``. Strings and
+    ``None`` are skipped.
+    """
+    samples: Dict[str, List[tuple[Dict[str, str], float]]] = {}
+
+    def rows(prefix: str, items: list) -> None:
+        for position, row in enumerate(items):
+            if not isinstance(row, dict):
+                continue
+            labels = _row_labels(row, position)
+            for field, value in row.items():
+                number = _number(value)
+                if field not in _ROW_SKIP and number is not None:
+                    samples.setdefault(f"{prefix}{field}", []).append((labels, number))
+
+    if isinstance(stats, list):
+        rows("", stats)
+        return samples
+    for key, value in stats.items():
+        if isinstance(value, list):
+            rows(f"{key}_", value)
+        elif isinstance(value, dict):
+            for sub, inner in value.items():
+                if isinstance(inner, dict):
+                    for field, item in inner.items():
+                        number = _number(item)
+                        if number is not None:
+                            samples.setdefault(f"{key}_{field}", []).append(({"name": str(sub)}, number))
+                elif (number := _number(inner)) is not None:
+                    samples.setdefault(key, []).append(({"name": str(sub)}, number))
+        elif (number := _number(value)) is not None:
+            samples.setdefault(key, []).append(({}, number))
+    return samples
+
+
+async def serve_metrics(
+    registry: MetricsRegistry,
+    host: str,
+    port: int,
+    profiler: Optional[SamplingProfiler] = None,
+) -> None:
+    """Serves ``/metrics`` (and ``/debug/profile?seconds=N`` with a profiler) until cancelled."""
+
+    async def metrics(_: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def profile(request: web.Request) -> web.Response:
+        try:
+            seconds = float(request.query.get("seconds", "30"))
+        except ValueError:
+            raise web.HTTPBadRequest(text="seconds must be a number")
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise web.HTTPBadRequest(text="seconds must be positive")
+        seconds = min(seconds, MAX_PROFILE_SECONDS, profiler.window)
+        return web.Response(text=profiler.collapsed(seconds), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    if profiler is not None:
+        app.router.add_get("/debug/profile", profile)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Метрики на http://{host}:{port}/metrics")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,54 @@
+import sys
+from collections import OrderedDict
+from typing import Callable, Hashable, Sequence
+
+from config_index import ConfigRecord
+
+
+class PageCache:
+    """Ready button labels for list pages.
+
+    Entries are keyed by ``(snapshot version, list token, page)`` and keep
+    only the labels and the offsets of the records they were rendered from;
+    a hit needs the page to hold the same records, so a re-sorted list
+    misses without the cache holding on to the list itself. Every user
+    paging the same list reuses the same labels. The cache is bounded by
+    the approximate size of what it keeps (``max_bytes``). Only the latency
+    part of a label is filled in at render time.
+    """
+
+    def __init__(self, render_label: Callable[[ConfigRecord], str], per_page: int, max_bytes: int = 4 * 1024 * 1024):
+        self.render_label = render_label
+        self.per_page = per_page
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, tuple[tuple[int, ...], tuple[str, ...], int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def page_records(self, configs: Sequence[ConfigRecord], page: int) -> Sequence[ConfigRecord]:
+        start = page * self.per_page
+        return configs[start:start + self.per_page]
+
+    def labels(self, key: Hashable, records: Sequence[ConfigRecord]) -> tuple[str, ...]:
+        offsets = tuple(rec.offset for rec in records)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == offsets:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        labels = tuple(self.render_label(rec) for rec in records)
+        size = sys.getsizeof(offsets) + sys.getsizeof(labels) + sum(map(sys.getsizeof, labels)) + sys.getsizeof(key)
+        if entry is not None:
+            self._bytes -= entry[2]
+        self._entries[key] = (offsets, labels, size)
+        self._entries.move_to_end(key)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old[2]
+        return labels
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+from latency import Endpoint, measure_tcp_ping
+from resolver import DnsCache
+
+logger = logging.getLogger(__name__)
+
+LINE_LIMIT = 64 * 1024 * 1024
+
+ProbeResult = tuple[str, int, Optional[float]]
+
+
+class _Process:
+    __slots__ = ("index", "process", "reader", "sweeps", "probes", "busy", "cpu")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.reader: Optional[asyncio.Task] = None
+        # Sweeps that sent this process a shard and still wait for its "done".
+        self.sweeps: set[int] = set()
+        self.probes = 0
+        self.busy = 0.0
+        self.cpu = 0.0
+
+
+class ProbePool:
+    """Sweeps endpoints with a pool of probe processes.
+
+    Each process runs its own event loop and DNS cache with ``concurrency``
+    probes in flight, paced to ``rate / processes`` probes per second when a
+    rate is set. A sweep shards the endpoints across the processes and yields
+    results in batches as the processes flush them (every ``batch_size``
+    results or ``flush_interval`` seconds). Processes are started on the
+    first sweep and report their probe count, busy time and CPU time so
+    throughput per core can be tracked.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        concurrency: int = 256,
+        rate: Optional[float] = None,
+        timeout: float = 3.0,
+        batch_size: int = 256,
+        flush_interval: float = 0.25,
+    ):
+        self.processes = processes
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._workers = [_Process(i) for i in range(processes)]
+        self._sweeps: Dict[int, asyncio.Queue] = {}
+        self._sweep_ids = itertools.count(1)
+        self._start_lock = asyncio.Lock()
+        self._closing = False
+        self.sweeps = 0
+        self.last_sweep: dict = {}
+
+    async def start(self) -> None:
+        async with self._start_lock:
+            for worker in self._workers:
+                if worker.process is None or worker.process.returncode is not None or worker.reader.done():
+                    if worker.process is not None and worker.process.returncode is None:
+                        try:
+                            worker.process.kill()
+                        except ProcessLookupError:
+                            pass
+                    await self._spawn(worker)
+
+    async def _spawn(self, worker: _Process) -> None:
+        per_process = self.rate / self.processes if self.rate else 0
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            os.path.abspath(__file__),
+            "--concurrency", str(self.concurrency),
+            "--rate", str(per_process),
+            "--timeout", str(self.timeout),
+            "--batch-size", str(self.batch_size),
+            "--flush-interval", str(self.flush_interval),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=LINE_LIMIT,
+        )
+        worker.reader = asyncio.create_task(self._read(worker))
+
+    async def _read(self, worker: _Process) -> None:
+        stdout = worker.process.stdout
+        while True:
+            line = await stdout.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            done = message.get("done")
+            if done is not None:
+                worker.sweeps.discard(message["sweep"])
+                worker.probes += done["probes"]
+                worker.busy += done["busy"]
+                worker.cpu += done["cpu"]
+            queue = self._sweeps.get(message["sweep"])
+            if queue is not None:
+                queue.put_nowait((worker.index, message.get("results", ()), done))
+        if not self._closing:
+            logger.warning(f"Процесс проверок #{worker.index} завершился")
+        for sweep_id in list(worker.sweeps):
+            self._lost(worker, sweep_id)
+
+    def _lost(self, worker: _Process, sweep_id: int) -> None:
+        """Completes a sweep's shard on ``worker`` with no results: the process is gone."""
+        worker.sweeps.discard(sweep_id)
+        queue = self._sweeps.get(sweep_id)
+        if queue is not None:
+            queue.put_nowait((worker.index, (), {"probes": 0, "busy": 0.0, "cpu": 0.0, "lost": True}))
+
+    async def sweep(self, endpoints: Sequence[Endpoint]) -> AsyncIterator[List[ProbeResult]]:
+        await self.start()
+        sweep_id = next(self._sweep_ids)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._sweeps[sweep_id] = queue
+        started = time.monotonic()
+        shards = [list(endpoints[i::self.processes]) for i in range(self.processes)]
+        remaining = 0
+        received = 0
+        try:
+            for worker, shard in zip(self._workers, shards):
+                if not shard:
+                    continue
+                # Registered before writing, so a reader that sees EOF meanwhile reports it lost.
+                worker.sweeps.add(sweep_id)
+                remaining += 1
+                try:
+                    worker.process.stdin.write(json.dumps({"sweep": sweep_id, "endpoints": shard}).encode() + b"\n")
+                    await worker.process.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                if worker.reader.done() and sweep_id in worker.sweeps:
+                    self._lost(worker, sweep_id)
+            while remaining:
+                _, results, done = await queue.get()
+                if results:
+                    received += len(results)
+                    yield [(host, port, value) for host, port, value in results]
+                if done is not None:
+                    remaining -= 1
+        finally:
+            del self._sweeps[sweep_id]
+            for worker in self._workers:
+                worker.sweeps.discard(sweep_id)
+        elapsed = time.monotonic() - started
+        self.sweeps += 1
+        self.last_sweep = {
+            "endpoints": len(endpoints),
+            "results": received,
+            "seconds": round(elapsed, 2),
+            "probes_per_s": round(received / elapsed, 1) if elapsed else 0.0,
+        }
+        logger.debug(f"Пул проверок: {self.last_sweep}, по ядрам: {self.stats()['per_core']}")
+
+    async def close(self) -> None:
+        self._closing = True
+        for worker in self._workers:
+            process = worker.process
+            if process is None or process.returncode is not None:
+                continue
+            process.stdin.close()
+            try:
+                await asyncio.wait_for(process.wait(), 5)
+            except asyncio.TimeoutError:
+                process.kill()
+            if worker.reader is not None:
+                worker.reader.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "processes": self.processes,
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "sweeps": self.sweeps,
+            "last_sweep": self.last_sweep,
+            "per_core": [
+                {
+                    "index": w.index,
+                    "pid": w.process.pid if w.process else None,
+                    "probes": w.probes,
+                    "probes_per_s": round(w.probes / w.busy, 1) if w.busy else 0.0,
+                    "cpu_s": round(w.cpu, 2),
+                    "cpu_util": round(w.cpu / w.busy, 2) if w.busy else 0.0,
+                }
+                for w in self._workers
+            ],
+        }
+
+
+async def _probe_shard(
+    sweep_id: int,
+    endpoints: Sequence[Endpoint],
+    resolver: DnsCache,
+    args: argparse.Namespace,
+) -> None:
+    started = time.monotonic()
+    started_cpu = time.process_time()
+    buffer: list[ProbeResult] = []
+    last_flush = started
+    next_slot = started
+    interval = 1 / args.rate if args.rate else 0.0
+    pending = iter(endpoints)
+
+    def flush(done: Optional[dict] = None) -> None:
+        nonlocal buffer, last_flush
+        message = {"sweep": sweep_id, "results": buffer}
+        if done is not None:
+            message["done"] = done
+        sys.stdout.write(json.dumps(message) + "\n")
+        sys.stdout.flush()
+        buffer = []
+        last_flush = time.monotonic()
+
+    async def run() -> None:
+        nonlocal next_slot
+        for host, port in pending:
+            if interval:
+                now = time.monotonic()
+                slot = max(now, next_slot)
+                next_slot = slot + interval
+                if slot > now:
+                    await asyncio.sleep(slot - now)
+            value = await measure_tcp_ping(host, port, args.timeout, resolver)
+            buffer.append((host, port, value))
+            if len(buffer) >= args.batch_size or time.monotonic() - last_flush >= args.flush_interval:
+                flush()
+
+    await asyncio.gather(*(run() for _ in range(min(args.concurrency, len(endpoints)))))
+    flush({
+        "probes": len(endpoints),
+        "busy": time.monotonic() - started,
+        "cpu": time.process_time() - started_cpu,
+    })
+
+
+async def _worker(args: argparse.Namespace) -> None:
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    resolver = DnsCache(concurrency=args.concurrency)
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        message = json.loads(line)
+        await _probe_shard(message["sweep"], [tuple(ep) for ep in message["endpoints"]], resolver, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Probe worker process (started by ProbePool)")
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=3.0)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--flush-interval", type=float, default=0.25)
+    asyncio.run(_worker(parser.parse_args()))
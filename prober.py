@@ -0,0 +1,207 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from typing import Dict, Iterable, Optional, Sequence
+
+from config_index import ConfigRecord
+from config_pool import ConfigPool
+from history import LatencyHistory
+from latency import Endpoint, LatencyCache, endpoint_key
+from probe_pool import ProbePool
+from resolver import DnsCache
+from scheduler import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+class HealthProber:
+    """Background sweep over every endpoint of the current snapshot.
+
+    Endpoints are probed at ``rate`` per second, most overdue first; endpoints
+    users actually look at age faster. Probes go through the shared latency
+    cache at background priority, and a ranking of the snapshot by composite
+    score (EWMA, jitter and success ratio over each endpoint's recent history)
+    is kept ready so "fastest" requests don't wait for a sweep. Results of
+    interactive probes made through the cache are recorded too, and history
+    carries over to new snapshots for endpoints that are still listed. With
+    an ``engine`` the batches are swept by a multi-process ProbePool instead
+    and its results are written into the cache.
+    """
+
+    def __init__(
+        self,
+        pool: ConfigPool,
+        cache: LatencyCache,
+        rate: float,
+        min_interval: float,
+        rank_interval: float = 5.0,
+        resolver: Optional[DnsCache] = None,
+        engine: Optional[ProbePool] = None,
+    ):
+        self.pool = pool
+        self.cache = cache
+        self.rate = rate
+        self.min_interval = min_interval
+        self.rank_interval = rank_interval
+        self.resolver = resolver
+        self.engine = engine
+        self.stats: Dict[Endpoint, LatencyHistory] = {}
+        self._version: Optional[int] = None
+        self._ranking: tuple[ConfigRecord, ...] = ()
+        self._ranked_at = 0.0
+        self._dirty = False
+        self.probes = 0
+        cache.observers.append(self._record)
+
+    def touch(self, host: str, port: int) -> None:
+        stats = self.stats.get(endpoint_key(host, port))
+        if stats is not None:
+            stats.requests += 1
+
+    def stats_for(self, rec: ConfigRecord) -> Optional[LatencyHistory]:
+        if not rec.address:
+            return None
+        return self.stats.get(endpoint_key(rec.host, rec.port))
+
+    def score_for(self, rec: ConfigRecord) -> float:
+        stats = self.stats_for(rec)
+        return stats.score if stats is not None else math.inf
+
+    def reachable(self, rec: ConfigRecord) -> Optional[bool]:
+        """Whether the endpoint is usable by its history; ``None`` until it has been probed."""
+        if not rec.address:
+            return False
+        stats = self.stats_for(rec)
+        if stats is None or not stats.count:
+            return None
+        return stats.score != math.inf
+
+    def coverage(self) -> float:
+        if not self.stats:
+            return 0.0
+        cutoff = time.monotonic() - self.min_interval * 2
+        fresh = sum(1 for s in self.stats.values() if s.last_probe >= cutoff)
+        return fresh / len(self.stats)
+
+    def ranking(self) -> tuple[ConfigRecord, ...]:
+        snapshot = self.pool.snapshot
+        if snapshot is None:
+            return ()
+        now = time.monotonic()
+        stale = snapshot.version != self._version or (self._dirty and now - self._ranked_at >= self.rank_interval)
+        if stale or not self._ranking:
+            self._sync(snapshot)
+            reachable = []
+            for rec in snapshot.records:
+                stats = self.stats_for(rec)
+                if stats is not None and stats.score != math.inf:
+                    reachable.append((stats.score, rec.offset, rec))
+            reachable.sort()
+            self._ranking = tuple(rec for _, _, rec in reachable)
+            self._ranked_at = now
+            self._dirty = False
+        return self._ranking
+
+    def rank(self, records: Sequence[ConfigRecord], limit: Optional[int] = None) -> Optional[tuple[ConfigRecord, ...]]:
+        ranking = self.ranking()
+        snapshot = self.pool.snapshot
+        if snapshot is None:
+            return None
+        if records is snapshot.records:
+            result = ranking
+        else:
+            wanted = {rec.offset for rec in records}
+            result = tuple(rec for rec in ranking if rec.offset in wanted)
+        if limit is not None:
+            if len(result) < limit:
+                return None
+            return result[:limit]
+        if self.coverage() < 0.9:
+            return None
+        return result
+
+    def dump(self) -> list[tuple]:
+        now = time.monotonic()
+        return [(host, port, *s.dump(), now - s.last_probe) for (host, port), s in self.stats.items() if s.probes]
+
+    def load(self, entries: Iterable[tuple]) -> int:
+        """Merges saved histories in; endpoints probed here more recently keep their own."""
+        now = time.monotonic()
+        loaded = 0
+        for host, port, *fields, age in entries:
+            key = endpoint_key(host, port)
+            current = self.stats.get(key)
+            if current is not None and current.probes and current.last_probe >= now - age:
+                continue
+            history = LatencyHistory.load(*fields, last_probe=now - age)
+            if current is not None:
+                history.requests = current.requests
+            self.stats[key] = history
+            loaded += 1
+        self._ranking = ()
+        return loaded
+
+    def _sync(self, snapshot) -> None:
+        if snapshot.version == self._version:
+            return
+        endpoints = {endpoint_key(rec.host, rec.port) for rec in snapshot.records if rec.address}
+        self.stats = {ep: self.stats.get(ep) or LatencyHistory() for ep in endpoints}
+        self._version = snapshot.version
+        self._ranking = ()
+
+    def _next_batch(self, size: int) -> list[Endpoint]:
+        now = time.monotonic()
+
+        def priority(item: tuple[Endpoint, LatencyHistory]) -> float:
+            _, stats = item
+            if not stats.probes:
+                return math.inf
+            age = now - stats.last_probe
+            if age < self.min_interval:
+                return -1.0
+            return age * (1.0 + math.log1p(stats.requests))
+
+        best = heapq.nlargest(size, self.stats.items(), key=priority)
+        return [ep for ep, stats in best if priority((ep, stats)) >= 0]
+
+    async def _probe(self, endpoint: Endpoint) -> None:
+        await self.cache.refresh(*endpoint, owner="prober", priority=BACKGROUND)
+
+    async def _sweep(self, batch: list[Endpoint]) -> None:
+        async for results in self.engine.sweep(batch):
+            for host, port, value in results:
+                self.cache.report(host, port, value)
+
+    def _record(self, endpoint: Endpoint, value: float | None) -> None:
+        stats = self.stats.get(endpoint_key(*endpoint))
+        if stats is not None:
+            stats.record(value, time.monotonic())
+            stats.requests //= 2
+        self.probes += 1
+        self._dirty = True
+
+    async def run(self) -> None:
+        batch_size = max(1, int(self.rate * (self.engine.timeout if self.engine is not None else 1)))
+        while True:
+            snapshot = self.pool.snapshot
+            if snapshot is None:
+                await asyncio.sleep(1)
+                continue
+            self._sync(snapshot)
+            batch = self._next_batch(batch_size)
+            if not batch:
+                await asyncio.sleep(1)
+                continue
+            started = time.monotonic()
+            try:
+                if self.engine is not None:
+                    await self._sweep(batch)
+                else:
+                    if self.resolver is not None:
+                        await self.resolver.prefetch(host for host, _ in batch)
+                    await asyncio.gather(*(self._probe(ep) for ep in batch))
+            except Exception as e:
+                logger.error(f"Ошибка фоновой проверки: {e}", exc_info=True)
+            await asyncio.sleep(max(0.0, len(batch) / self.rate - (time.monotonic() - started)))
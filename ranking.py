@@ -0,0 +1,109 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable, Generic, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+class TopK(Generic[T]):
+    """Bounded max-heap keeping the ``k`` lowest latencies seen so far."""
+
+    def __init__(self, k: int):
+        self.k = k
+        self._heap: list[tuple[float, int, T]] = []
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    @property
+    def full(self) -> bool:
+        return len(self._heap) >= self.k
+
+    @property
+    def worst(self) -> float:
+        return -self._heap[0][0] if self._heap else float("inf")
+
+    def push(self, latency: float, item: T) -> bool:
+        entry = (-latency, -next(self._seq), item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if latency < -self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def items(self) -> List[tuple[float, T]]:
+        return [(-neg, item) for neg, _, item in sorted(self._heap, key=lambda e: (-e[0], -e[1]))]
+
+
+class StreamingRanker(Generic[T]):
+    """Probes items concurrently and keeps the fastest ``k`` as results arrive.
+
+    ``on_update`` is called with the best-so-far ranking once ``first_deadline``
+    seconds have passed and then at most every ``refresh_interval`` seconds
+    while probing continues. Probing stops early when the heap is full and its
+    worst latency is at or below ``confident_ms``; the remaining probes are
+    cancelled so their slots are released.
+    """
+
+    def __init__(
+        self,
+        probe: Callable[[T], Awaitable[Optional[float]]],
+        k: int,
+        confident_ms: Optional[float] = None,
+        first_deadline: float = 2.0,
+        refresh_interval: float = 3.0,
+        on_update: Optional[Callable[["StreamingRanker[T]"], Awaitable[None]]] = None,
+    ):
+        self.probe = probe
+        self.top: TopK[T] = TopK(max(1, k))
+        self.confident_ms = confident_ms
+        self.first_deadline = first_deadline
+        self.refresh_interval = refresh_interval
+        self.on_update = on_update
+        self.total = 0
+        self.processed = 0
+        self.failed: list[T] = []
+        self.stopped_early = False
+
+    def ranked(self) -> list[T]:
+        return [item for _, item in self.top.items()]
+
+    def confident(self) -> bool:
+        return self.confident_ms is not None and self.top.full and self.top.worst <= self.confident_ms
+
+    async def run(self, items: Sequence[T]) -> list[T]:
+        self.total = len(items)
+        started = time.monotonic()
+        next_update = started + self.first_deadline
+        tasks = {asyncio.ensure_future(self.probe(item)): item for item in items}
+        pending = set(tasks)
+        try:
+            while pending:
+                timeout = max(0.0, next_update - time.monotonic()) if self.on_update else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    self.processed += 1
+                    latency = None if task.cancelled() or task.exception() else task.result()
+                    if latency is None:
+                        self.failed.append(tasks[task])
+                    else:
+                        self.top.push(latency, tasks[task])
+                if pending and self.confident():
+                    self.stopped_early = True
+                    break
+                if self.on_update and pending and time.monotonic() >= next_update:
+                    if len(self.top):
+                        await self.on_update(self)
+                        next_update = time.monotonic() + self.refresh_interval
+                    else:
+                        next_update = time.monotonic() + 0.5
+        finally:
+            for task in pending:
+                task.cancel()
+        return self.ranked()
+
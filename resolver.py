@@ -0,0 +1,118 @@
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+
+def is_ip_literal(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+class DnsCache:
+    """Async A/AAAA cache in front of the loop's resolver.
+
+    Successful lookups are kept for ``ttl`` seconds, failures for
+    ``negative_ttl``; concurrent lookups of one host share a single query and
+    ``prefetch`` resolves a whole batch with bounded parallelism so probes can
+    connect straight to literal IPs. The time each lookup took is kept next to
+    the address so callers can report DNS and connect time separately.
+    """
+
+    def __init__(self, ttl: float = 300, negative_ttl: float = 60, max_size: int = 100000, concurrency: int = 32):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.concurrency = concurrency
+        self._entries: "OrderedDict[str, tuple[float, Optional[str], float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.lookup_time = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, host: str) -> Optional[tuple[Optional[str], float]]:
+        entry = self._entries.get(host)
+        if entry is None or time.monotonic() >= entry[0]:
+            return None
+        return entry[1], entry[2]
+
+    async def resolve(self, host: str) -> Optional[str]:
+        if is_ip_literal(host):
+            return host
+        entry = self._entries.get(host)
+        if entry is not None and time.monotonic() < entry[0]:
+            self._entries.move_to_end(host)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[1]
+        future = self._inflight.get(host)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._lookup(host))
+            self._inflight[host] = future
+        return await asyncio.shield(future)
+
+    async def prefetch(self, hosts: Iterable[str]) -> None:
+        now = time.monotonic()
+        pending = set()
+        for host in hosts:
+            if is_ip_literal(host):
+                continue
+            entry = self._entries.get(host)
+            if entry is None or now >= entry[0]:
+                pending.add(host)
+        if pending:
+            await asyncio.gather(*(self.resolve(host) for host in pending), return_exceptions=True)
+
+    async def _lookup(self, host: str) -> Optional[str]:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        address: Optional[str] = None
+        try:
+            async with self._sem:
+                started = time.perf_counter()
+                try:
+                    infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+                except (OSError, UnicodeError):
+                    infos = []
+                elapsed = time.perf_counter() - started
+            self.lookup_time += elapsed
+            ipv4 = [info[4][0] for info in infos if info[0] == socket.AF_INET]
+            ipv6 = [info[4][0] for info in infos if info[0] == socket.AF_INET6]
+            address = (ipv4 or ipv6 or [None])[0]
+            if address is None:
+                self.failures += 1
+            ttl = self.ttl if address is not None else self.negative_ttl
+            self._entries[host] = (time.monotonic() + ttl, address, round(elapsed * 1000, 1))
+            self._entries.move_to_end(host)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return address
+        finally:
+            self._inflight.pop(host, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "failures": self.failures,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 3) if lookups else 0.0,
+            "avg_lookup_ms": round(self.lookup_time / self.misses * 1000, 1) if self.misses else 0.0,
+        }
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from functools import partial
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from latency import Endpoint, endpoint_key, measure_tcp_ping
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+BACKGROUND = 2
+PRIORITY_NAMES = ("interactive", "bulk", "background")
+
+
+class _Job:
+    __slots__ = ("endpoint", "priority", "owner", "future", "enqueued_at", "task", "waiters")
+
+    def __init__(self, endpoint: Endpoint, priority: int, owner: Hashable, future: asyncio.Future):
+        self.endpoint = endpoint
+        self.priority = priority
+        self.owner = owner
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+
+
+class ProbeScheduler:
+    """Single gate for every outbound probe in the process.
+
+    At most ``max_inflight`` probes run at once. Queued probes are served by
+    priority class (interactive page renders, then bulk sorts, then the
+    background prober) and, within a class, round-robin across owners so one
+    user's "fastest:all" can't starve everyone else. Requests for an endpoint
+    that is already queued share its job and can raise its priority; once
+    every waiter of a job is cancelled, the job leaves the queue or, if it is
+    already running, is cancelled to free its slot.
+    """
+
+    def __init__(
+        self,
+        max_inflight: int,
+        probe: Callable[[str, int], Awaitable[float | None]] = measure_tcp_ping,
+    ):
+        self.max_inflight = max_inflight
+        self.probe = probe
+        self._queues: list["OrderedDict[Hashable, Deque[_Job]]"] = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._jobs: Dict[Endpoint, _Job] = {}
+        self._inflight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.wait_total = [0.0] * len(PRIORITY_NAMES)
+        self.wait_max = [0.0] * len(PRIORITY_NAMES)
+        self.dispatched = [0] * len(PRIORITY_NAMES)
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        queues = self._queues if priority is None else [self._queues[priority]]
+        return sum(sum(1 for job in q if not job.future.done()) for owner_q in queues for q in owner_q.values())
+
+    async def submit(self, host: str, port: int, owner: Hashable = None, priority: int = BULK) -> float | None:
+        endpoint = endpoint_key(host, port)
+        job = self._jobs.get(endpoint)
+        if job is None or job.future.done():
+            job = _Job(endpoint, priority, owner, asyncio.get_running_loop().create_future())
+            job.future.add_done_callback(partial(self._on_job_done, job))
+            self._jobs[endpoint] = job
+            self.submitted += 1
+            self._enqueue(job)
+        elif job.task is None and priority < job.priority:
+            job.priority = priority
+            job.owner = owner
+            self._enqueue(job)
+        self._dispatch()
+        job.waiters += 1
+        try:
+            return await asyncio.shield(job.future)
+        finally:
+            job.waiters -= 1
+            if not job.waiters and not job.future.done():
+                job.future.cancel()
+
+    def promote(self, host: str, port: int, priority: int, owner: Hashable = None) -> None:
+        job = self._jobs.get(endpoint_key(host, port))
+        if job is not None and job.task is None and not job.future.done() and priority < job.priority:
+            job.priority = priority
+            job.owner = owner
+            self._enqueue(job)
+            self._dispatch()
+
+    async def drain(self, timeout: float) -> int:
+        deadline = time.monotonic() + timeout
+        while self._jobs and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return len(self._jobs)
+
+    def _enqueue(self, job: _Job) -> None:
+        self._queues[job.priority].setdefault(job.owner, deque()).append(job)
+
+    def _next_job(self) -> Optional[_Job]:
+        for level, owners in enumerate(self._queues):
+            while owners:
+                owner, queue = next(iter(owners.items()))
+                job = queue.popleft()
+                if queue:
+                    owners.move_to_end(owner)
+                else:
+                    del owners[owner]
+                if job.future.done() or job.task is not None or job.priority != level:
+                    continue
+                return job
+        return None
+
+    def _dispatch(self) -> None:
+        while self._inflight < self.max_inflight:
+            job = self._next_job()
+            if job is None:
+                return
+            wait = time.monotonic() - job.enqueued_at
+            self.wait_total[job.priority] += wait
+            self.wait_max[job.priority] = max(self.wait_max[job.priority], wait)
+            self.dispatched[job.priority] += 1
+            self._inflight += 1
+            job.task = asyncio.ensure_future(self._run(job))
+
+    async def _run(self, job: _Job) -> None:
+        try:
+            value = await self.probe(*job.endpoint)
+        except asyncio.CancelledError:
+            value = None
+        except Exception as e:
+            logger.warning(f"Ошибка проверки {job.endpoint}: {e}")
+            value = None
+        finally:
+            self._inflight -= 1
+            self.completed += 1
+            if self._jobs.get(job.endpoint) is job:
+                del self._jobs[job.endpoint]
+            self._dispatch()
+        if not job.future.done():
+            job.future.set_result(value)
+
+    def _on_job_done(self, job: _Job, future: asyncio.Future) -> None:
+        if not future.cancelled():
+            return
+        self.cancelled += 1
+        if job.task is not None:
+            job.task.cancel()
+        elif self._jobs.get(job.endpoint) is job:
+            del self._jobs[job.endpoint]
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self._inflight,
+            "max_inflight": self.max_inflight,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "queues": {
+                name: {
+                    "depth": self.queue_depth(level),
+                    "owners": len(self._queues[level]),
+                    "dispatched": self.dispatched[level],
+                    "avg_wait_ms": round(self.wait_total[level] / self.dispatched[level] * 1000, 1)
+                    if self.dispatched[level] else 0.0,
+                    "max_wait_ms": round(self.wait_max[level] * 1000, 1),
+                }
+                for level, name in enumerate(PRIORITY_NAMES)
+            },
+        }
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyMiddleware(BaseMiddleware):
+    """Caps how many updates are handled at once; the rest wait their turn.
+
+    Works the same for polling and webhooks. ``drain`` waits until every
+    update that has entered the middleware is finished.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._sem = asyncio.Semaphore(limit)
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.active = 0
+        self.peak = 0
+        self.handled = 0
+        self.wait_total = 0.0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self._pending += 1
+        self._idle.clear()
+        started = time.monotonic()
+        try:
+            async with self._sem:
+                self.wait_total += time.monotonic() - started
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+                try:
+                    return await handler(event, data)
+                finally:
+                    self.active -= 1
+                    self.handled += 1
+        finally:
+            self._pending -= 1
+            if not self._pending:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self._pending - self.active,
+            "peak": self.peak,
+            "handled": self.handled,
+            "avg_wait_ms": round(self.wait_total / self.handled * 1000, 1) if self.handled else 0.0,
+        }
+
+
+def handler_name(event: TelegramObject) -> str:
+    """Metric label for an update: callback prefix up to ':' (``page:``, ``cfg:``), the command, or the update type."""
+    data = getattr(event, "data", None)
+    if isinstance(data, str):
+        head, sep, _ = data.partition(":")
+        return head + sep
+    text = getattr(event, "text", None)
+    if isinstance(text, str) and text.startswith("/"):
+        return text.split(maxsplit=1)[0].split("@", 1)[0]
+    return type(event).__name__.lower()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Reports each handler's run time to ``observe(name, seconds)``.
+
+    With a ``profiler`` and ``slow_ms`` set, handlers slower than that get
+    the event loop's hottest stacks during their run logged.
+    """
+
+    def __init__(
+        self,
+        observe: Callable[[str, float], None],
+        profiler: Optional[Any] = None,
+        slow_ms: float = 0.0,
+    ):
+        self.observe = observe
+        self.profiler = profiler
+        self.slow = slow_ms / 1000
+        self.slow_handled = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        started = time.monotonic()
+        try:
+            return await handler(event, data)
+        finally:
+            ended = time.monotonic()
+            name = handler_name(event)
+            self.observe(name, ended - started)
+            if self.profiler is not None and self.slow and ended - started >= self.slow:
+                self.slow_handled += 1
+                top = self.profiler.top(started, ended)
+                if top:
+                    stacks = "\n".join(f"  {n:>4} {stack}" for stack, n in top)
+                    logger.warning(f"Медленный обработчик {name}: {(ended - started) * 1000:.0f}ms\n{stacks}")
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str,
+    port: int,
+    path: str,
+    public_url: Optional[str] = None,
+    secret: Optional[str] = None,
+) -> None:
+    """Serves updates over a webhook until SIGINT/SIGTERM.
+
+    The route is registered without aiogram's shutdown hook so the bot
+    session stays open after the server stops and in-flight handlers can
+    still finish; closing it is left to the caller. Without ``public_url``
+    the webhook is not registered with Telegram (useful against a local API
+    stand-in).
+    """
+    app = web.Application()
+    handler = SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret)
+    app.router.add_post(path, handler.handle)
+    setup_application(app, dp, bot=bot)
+    await serve(app, host, port, path, bot, public_url, secret)
+
+
+async def serve(
+    app: web.Application,
+    host: str,
+    port: int,
+    path: str,
+    bot: Optional[Bot] = None,
+    public_url: Optional[str] = None,
+    secret: Optional[str] = None,
+) -> None:
+    """Runs ``app`` until SIGINT/SIGTERM, registering the webhook first when ``bot`` is given."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    if bot is not None and public_url:
+        await bot.set_webhook(f"{public_url.rstrip('/')}{path}", secret_token=secret, drop_pending_updates=True)
+    logger.info(f"Вебхук слушает http://{host}:{port}{path}")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()
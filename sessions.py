@@ -0,0 +1,138 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+
+from config_index import ConfigRecord
+
+
+class Session:
+    """What one user is looking at: a filter over a snapshot, an optional ranking and a page."""
+
+    __slots__ = ("user_id", "version", "protocol", "country", "ranked", "ranked_at", "page", "touched", "size")
+
+    def __init__(self, user_id: int, version: int, protocol: Optional[str] = None, country: Optional[str] = None):
+        self.user_id = user_id
+        self.version = version
+        self.protocol = protocol
+        self.country = country
+        self.ranked: Optional[Sequence[ConfigRecord]] = None
+        self.ranked_at = 0.0
+        self.page = 0
+        self.touched = time.monotonic()
+        self.size = sys.getsizeof(self)
+
+    def ranking(self, ttl: float) -> Optional[Sequence[ConfigRecord]]:
+        if self.ranked is not None and time.time() - self.ranked_at <= ttl:
+            return self.ranked
+        return None
+
+
+class SessionStore:
+    """Per-user sessions with idle expiry and LRU eviction.
+
+    A session only holds its filter and page plus, once sorted, a reference
+    to its ranking; the config lists themselves belong to the shared
+    snapshot. Sessions idle for longer than ``ttl`` seconds are dropped, and
+    the least recently used ones are evicted while the store is above
+    ``max_sessions`` or ``max_bytes`` (the sessions plus the rankings they
+    keep alive). Rankings are shared between sessions, so each one is
+    counted once, however many sessions refer to it.
+    """
+
+    def __init__(self, ttl: float, max_sessions: int = 100000, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+        self._bytes = 0
+        # id(ranking) -> [sessions referring to it, its size]
+        self._rankings: Dict[int, list[int]] = {}
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def get(self, user_id: int) -> Optional[Session]:
+        self._expire()
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.touched = time.monotonic()
+            self._sessions.move_to_end(user_id)
+        return session
+
+    def open(self, user_id: int, version: int, protocol: Optional[str] = None, country: Optional[str] = None) -> Session:
+        old = self._sessions.pop(user_id, None)
+        if old is not None:
+            self._release(old)
+        session = Session(user_id, version, protocol, country)
+        self._sessions[user_id] = session
+        self._bytes += session.size
+        self._expire()
+        self._evict()
+        return session
+
+    def set_ranking(self, session: Session, ranked: Optional[Sequence[ConfigRecord]]) -> None:
+        stored = self._sessions.get(session.user_id) is session
+        if stored and session.ranked is not None:
+            self._drop_ranking(session.ranked)
+        session.ranked = ranked
+        session.ranked_at = time.time()
+        if stored and ranked is not None:
+            self._hold_ranking(ranked)
+            self._evict()
+
+    def _hold_ranking(self, ranked: Sequence[ConfigRecord]) -> None:
+        entry = self._rankings.get(id(ranked))
+        if entry is None:
+            entry = self._rankings[id(ranked)] = [0, sys.getsizeof(ranked)]
+            self._bytes += entry[1]
+        entry[0] += 1
+
+    def _drop_ranking(self, ranked: Sequence[ConfigRecord]) -> None:
+        entry = self._rankings[id(ranked)]
+        entry[0] -= 1
+        if not entry[0]:
+            del self._rankings[id(ranked)]
+            self._bytes -= entry[1]
+
+    def drop(self, user_id: int) -> Optional[Session]:
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self._release(session)
+        return session
+
+    def _release(self, session: Session) -> None:
+        self._bytes -= session.size
+        if session.ranked is not None:
+            self._drop_ranking(session.ranked)
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.touched > deadline:
+                return
+            del self._sessions[user_id]
+            self._release(session)
+            self.expired += 1
+
+    def _evict(self) -> None:
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            _, session = self._sessions.popitem(last=False)
+            self._release(session)
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "ranked": sum(1 for s in self._sessions.values() if s.ranked is not None),
+            "rankings": len(self._rankings),
+            "bytes": self._bytes,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,36 @@
+"""Settings shared by the bot and the batch CLI; importing this module needs no bot token."""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SOURCES = [
+    "https://raw.githubusercontent.com/barry-far/V2ray-Config/main/All_Configs_Sub.txt",
+    "https://raw.githubusercontent.com/barry-far/V2ray-Config/main/All_Configs_base64_Sub.txt",
+    "https://raw.githubusercontent.com/Epodonios/v2ray-configs/main/All_Configs_Sub.txt",
+    "https://raw.githubusercontent.com/Epodonios/v2ray-configs/main/All_Configs_base64_Sub.txt",
+    "https://raw.githubusercontent.com/MatinGhanbari/v2ray-configs/main/subscriptions/v2ray/all_sub.txt",
+    "https://raw.githubusercontent.com/MatinGhanbari/v2ray-configs/main/subscriptions/v2ray/super-sub.txt",
+    "https://raw.githubusercontent.com/sevcator/5ubscrpt10n/main/sub/vless+vmess+trojan+ss.txt",
+    "https://raw.githubusercontent.com/SoliSpirit/v2ray-configs/main/all_configs.txt",
+    "https://raw.githubusercontent.com/ebrasha/free-v2ray-public-list/main/all_extracted_configs.txt",
+    "https://raw.githubusercontent.com/ninjastrikers/v2ray-configs/main/combined/all.txt",
+    "https://raw.githubusercontent.com/zipvpn/FreeVPNNodes/main/free_v2ray_xray_nodes.txt",
+]
+
+UPDATE_INTERVAL_MIN = 30
+PING_CACHE_TTL = 600
+MAX_INFLIGHT_PROBES = 200
+PROBE_TIMEOUT = 3.0
+DNS_CACHE_TTL = 300
+DNS_NEGATIVE_TTL = 60
+PING_CACHE_MAX_ENDPOINTS = 50000
+PROBE_RATE = 50
+PROBE_MIN_INTERVAL = PING_CACHE_TTL / 2
+PROBE_PROCESSES = int(os.getenv("PROBE_PROCESSES", "0"))
+PROBE_POOL_CONCURRENCY = int(os.getenv("PROBE_POOL_CONCURRENCY", "256"))
+PROBE_POOL_RATE = int(os.getenv("PROBE_POOL_RATE", "2000"))
+CONFIDENT_PING_MS = 300
+COUNTRIES = ("ru", "de", "us", "pl", "fr", "nl")
+GEOIP_DB = os.getenv("GEOIP_DB", "geoip.csv")
@@ -0,0 +1,178 @@
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+from config_index import ConfigIndex, ConfigRecord
+from sources import SourceState
+
+logger = logging.getLogger(__name__)
+
+HEALTH_ALPHA = 0.3
+LOW_YIELD = 0.02
+MIN_KNOWN = 20
+TIMEOUT_FACTOR = 3.0
+TIMEOUT_SLACK = 2.0
+
+
+@dataclass
+class SourceHealth:
+    url: str
+    latency: Optional[float] = None
+    failure_rate: float = 0.0
+    change_rate: float = 0.5
+    churn: float = 0.0
+    yield_ratio: Optional[float] = None
+    consecutive_failures: int = 0
+    interval: float = 0.0
+    timeout: float = 0.0
+    next_at: float = 0.0
+
+    @property
+    def cold(self) -> bool:
+        return self.yield_ratio is not None and self.yield_ratio < LOW_YIELD
+
+    def as_dict(self, now: float) -> dict:
+        return {
+            "url": self.url,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "failure_rate": round(self.failure_rate, 2),
+            "change_rate": round(self.change_rate, 2),
+            "churn": round(self.churn, 3),
+            "yield": round(self.yield_ratio, 3) if self.yield_ratio is not None else None,
+            "cold": self.cold,
+            "consecutive_failures": self.consecutive_failures,
+            "interval_s": round(self.interval),
+            "timeout_s": round(self.timeout, 1),
+            "due_in_s": round(max(0.0, self.next_at - now)),
+        }
+
+
+class SourceSchedule:
+    """Per-source refresh intervals and timeouts derived from how each source behaves.
+
+    After every fetch a source's fetch latency, failure rate, change rate and
+    churn (share of configs added or removed) are folded into EWMAs. Sources
+    that change often and a lot are refreshed down to ``min_interval``,
+    static ones up to ``max_interval``; failures back off exponentially from
+    ``backoff``. The timeout follows the source's own download time instead of
+    the global ``max_timeout``, so a slow mirror no longer holds up a round of
+    fast ones. Sources whose unique configs are almost never reachable
+    (``reachable`` reports the prober's verdict) go cold and are only
+    refreshed every ``max_interval``; their last configs stay in the pool.
+    """
+
+    def __init__(
+        self,
+        states: Dict[str, SourceState],
+        base_interval: float,
+        max_timeout: float,
+        min_interval: Optional[float] = None,
+        max_interval: Optional[float] = None,
+        min_timeout: float = 5.0,
+        backoff: float = 60.0,
+        reachable: Optional[Callable[[ConfigRecord], Optional[bool]]] = None,
+    ):
+        self.states = states
+        self.base_interval = base_interval
+        self.min_interval = min_interval if min_interval is not None else base_interval / 6
+        self.max_interval = max_interval if max_interval is not None else base_interval * 4
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.backoff = backoff
+        self.reachable = reachable
+        self.health: Dict[str, SourceHealth] = {
+            url: SourceHealth(url, interval=base_interval, timeout=max_timeout) for url in states
+        }
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        now = time.monotonic() if now is None else now
+        return [url for url, h in self.health.items() if h.next_at <= now]
+
+    def next_due(self) -> float:
+        return min((h.next_at for h in self.health.values()), default=time.monotonic() + self.base_interval)
+
+    def timeouts(self, urls: Sequence[str]) -> Dict[str, float]:
+        return {url: self.health[url].timeout for url in urls}
+
+    def record(self, url: str, outcome: Optional[bool], now: Optional[float] = None) -> None:
+        """Folds the result of one fetch in; ``outcome`` is changed / unchanged / ``None`` for failed."""
+        now = time.monotonic() if now is None else now
+        h = self.health[url]
+        state = self.states[url]
+        failed = outcome is None
+        h.failure_rate += HEALTH_ALPHA * (failed - h.failure_rate)
+        if failed:
+            h.consecutive_failures += 1
+            h.timeout = self.max_timeout
+            h.interval = min(self.max_interval, self.backoff * 2 ** (h.consecutive_failures - 1))
+            h.next_at = now + h.interval * random.uniform(0.9, 1.1)
+            if h.consecutive_failures in (1, 3) or h.interval >= self.max_interval:
+                logger.warning(
+                    f"Источник {url} недоступен ({state.last_error}), "
+                    f"попыток подряд: {h.consecutive_failures}, следующая через {h.interval:.0f}s"
+                )
+            return
+        h.consecutive_failures = 0
+        if not outcome:
+            h.change_rate -= HEALTH_ALPHA * h.change_rate
+            h.churn -= HEALTH_ALPHA * h.churn
+        elif state.changes > 1:
+            churn = (state.last_added + state.last_removed) / max(len(state.configs), 1)
+            h.change_rate += HEALTH_ALPHA * (1.0 - h.change_rate)
+            h.churn += HEALTH_ALPHA * (min(churn, 1.0) - h.churn)
+        if state.last_status == 200:
+            h.latency = state.last_duration if h.latency is None else h.latency + HEALTH_ALPHA * (
+                state.last_duration - h.latency
+            )
+        if h.latency is not None:
+            h.timeout = min(self.max_timeout, max(self.min_timeout, h.latency * TIMEOUT_FACTOR + TIMEOUT_SLACK))
+        if h.cold:
+            h.interval = self.max_interval
+        else:
+            factor = 1 + 3 * h.change_rate + 5 * h.churn
+            h.interval = min(self.max_interval, max(self.min_interval, 2 * self.base_interval / factor))
+        h.next_at = now + h.interval * random.uniform(0.95, 1.05)
+
+    def update_yields(self, index: ConfigIndex) -> None:
+        """Share of each source's configs that are unique to it and known reachable.
+
+        A config counts for the first source that lists it. The yield stays
+        unknown until ``MIN_KNOWN`` of a source's unique configs (or all of
+        them, if it has fewer) were probed.
+        """
+        if self.reachable is None:
+            return
+        now = time.monotonic()
+        by_raw = {rec.raw: rec for rec in index.records}
+        seen: set[int] = set()
+        for url, state in self.states.items():
+            unique = known = hits = 0
+            for raw in state.configs:
+                rec = by_raw.get(raw)
+                if rec is None or rec.offset in seen:
+                    continue
+                seen.add(rec.offset)
+                unique += 1
+                verdict = self.reachable(rec)
+                if verdict is None:
+                    continue
+                known += 1
+                hits += verdict
+            h = self.health[url]
+            was_cold = h.cold
+            if not state.configs or known < min(unique, MIN_KNOWN):
+                h.yield_ratio = None
+            else:
+                h.yield_ratio = unique / len(state.configs) * (hits / known if known else 0.0)
+            if h.cold:
+                if not was_cold:
+                    logger.info(f"Источник {url} исключён из частых обновлений (полезных конфигов {h.yield_ratio:.1%})")
+            elif was_cold:
+                h.next_at = min(h.next_at, now + self.min_interval)
+                logger.info(f"Источник {url} снова в частых обновлениях")
+
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        return [h.as_dict(now) for h in self.health.values()]
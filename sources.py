@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import aiohttp
+
+from subparser import SubscriptionParser
+
+MAX_SOURCE_BYTES = 32 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SourceState:
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    configs: tuple[str, ...] = ()
+    last_status: Optional[int] = None
+    last_error: Optional[str] = None
+    last_duration: float = 0.0
+    last_bytes: int = 0
+    last_truncated: bool = False
+    last_added: int = 0
+    last_removed: int = 0
+    last_fetch_at: Optional[float] = None
+    last_change_at: Optional[float] = None
+    fetches: int = 0
+    not_modified: int = 0
+    changes: int = 0
+    failures: int = 0
+    total_bytes: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "configs": len(self.configs),
+            "status": self.last_status,
+            "error": self.last_error,
+            "duration_ms": round(self.last_duration * 1000, 1),
+            "bytes": self.last_bytes,
+            "truncated": self.last_truncated,
+            "added": self.last_added,
+            "removed": self.last_removed,
+            "fetches": self.fetches,
+            "not_modified": self.not_modified,
+            "changes": self.changes,
+            "failures": self.failures,
+            "total_bytes": self.total_bytes,
+            "last_change_at": self.last_change_at,
+        }
+
+
+@dataclass
+class RefreshReport:
+    changed: List[str]
+    unchanged: List[str]
+    failed: List[str]
+    bytes: int
+    duration: float
+
+    def summary(self) -> str:
+        return (
+            f"изменено {len(self.changed)}, без изменений {len(self.unchanged)}, "
+            f"ошибок {len(self.failed)}, {self.bytes / 1024:.0f} KB за {self.duration:.1f}s"
+        )
+
+
+class SourceFetcher:
+    """Keeps per-source validators and parsed results between refreshes.
+
+    Every refresh sends conditional requests; a 304 (or an identical body from
+    a server that ignores validators) reuses the configs parsed last time, so
+    only changed sources are re-parsed. A failed fetch also keeps the last good
+    result instead of dropping the source from the pool. ``refresh`` can be
+    limited to some of the sources and given per-source timeouts.
+    """
+
+    def __init__(self, sources: Sequence[str], timeout: float = 15, max_bytes: int = MAX_SOURCE_BYTES):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.states: Dict[str, SourceState] = {url: SourceState(url) for url in sources}
+
+    async def refresh(
+        self,
+        urls: Optional[Sequence[str]] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+    ) -> RefreshReport:
+        started = time.monotonic()
+        states = [self.states[url] for url in urls] if urls is not None else list(self.states.values())
+        timeouts = timeouts or {}
+        async with aiohttp.ClientSession() as session:
+            results = await asyncio.gather(
+                *[self._fetch_one(session, state, timeouts.get(state.url, self.timeout)) for state in states],
+                return_exceptions=True,
+            )
+        report = RefreshReport([], [], [], 0, 0.0)
+        for state, res in zip(states, results):
+            if isinstance(res, BaseException):
+                state.failures += 1
+                state.last_error = repr(res)
+                report.failed.append(state.url)
+                continue
+            report.bytes += state.last_bytes
+            if res is None:
+                report.failed.append(state.url)
+            elif res:
+                report.changed.append(state.url)
+            else:
+                report.unchanged.append(state.url)
+        report.duration = time.monotonic() - started
+        return report
+
+    async def _fetch_one(self, session: aiohttp.ClientSession, state: SourceState, timeout: float) -> Optional[bool]:
+        headers = {}
+        if state.etag:
+            headers["If-None-Match"] = state.etag
+        if state.last_modified:
+            headers["If-Modified-Since"] = state.last_modified
+        started = time.monotonic()
+        state.fetches += 1
+        state.last_fetch_at = time.time()
+        state.last_bytes = 0
+        state.last_added = state.last_removed = 0
+        try:
+            async with session.get(state.url, headers=headers, timeout=timeout) as resp:
+                state.last_status = resp.status
+                if resp.status == 304:
+                    state.not_modified += 1
+                    state.last_error = None
+                    return False
+                if resp.status != 200:
+                    state.failures += 1
+                    state.last_error = f"HTTP {resp.status}"
+                    return None
+                etag = resp.headers.get("ETag")
+                last_modified = resp.headers.get("Last-Modified")
+                hasher = hashlib.blake2b(digest_size=16)
+                parser = SubscriptionParser(self.max_bytes)
+                configs: list[str] = []
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    hasher.update(chunk)
+                    configs.extend(parser.feed(chunk))
+                    if parser.truncated:
+                        break
+                configs.extend(parser.close())
+        except Exception as e:
+            state.failures += 1
+            state.last_error = repr(e)
+            return None
+        finally:
+            state.last_duration = time.monotonic() - started
+        state.last_bytes = parser.bytes_read
+        state.last_truncated = parser.truncated
+        state.total_bytes += parser.bytes_read
+        state.last_error = None
+        state.etag = etag
+        state.last_modified = last_modified
+        if parser.truncated:
+            logger.warning(f"Источник {state.url} обрезан по лимиту {self.max_bytes} байт")
+        content_hash = hasher.hexdigest()
+        if content_hash == state.content_hash:
+            state.not_modified += 1
+            return False
+        old, new = set(state.configs), set(configs)
+        state.last_added = len(new - old)
+        state.last_removed = len(old - new)
+        state.content_hash = content_hash
+        state.configs = tuple(configs)
+        state.changes += 1
+        state.last_change_at = time.time()
+        return True
+
+    def merged(self) -> list[str]:
+        configs: list[str] = []
+        for state in self.states.values():
+            configs.extend(state.configs)
+        return configs
+
+    def stats(self) -> list[dict]:
+        return [state.as_dict() for state in self.states.values()]
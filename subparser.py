@@ -0,0 +1,148 @@
+import binascii
+import re
+from typing import Iterable, Iterator, Optional
+
+CONFIG_SCHEMES = ('vmess://', 'vless://', 'trojan://', 'ss://', 'ssr://')
+SKIP_PREFIXES = ('#', '备注', '备注:', '说明', '备注：', 'سرور', 'Channel', 'Group', '必进', '--------------------------------')
+
+MAX_LINE_BYTES = 64 * 1024
+SNIFF_BYTES = 256
+
+_BASE64_BODY = re.compile(rb"^[A-Za-z0-9+/=_\-\s]+$")
+_WHITESPACE = re.compile(rb"\s+")
+_URLSAFE = bytes.maketrans(b"-_", b"+/")
+
+
+def parse_config_line(line: str) -> Optional[str]:
+    line = line.strip()
+    if not line or line.startswith(SKIP_PREFIXES):
+        return None
+    if line.startswith(CONFIG_SCHEMES):
+        return line
+    return None
+
+
+class _LineSplitter:
+    def __init__(self):
+        self._tail = b""
+        self._skipping = False
+
+    def feed(self, data: bytes) -> Iterator[str]:
+        buf = self._tail + data if self._tail else data
+        start = 0
+        while True:
+            nl = buf.find(b"\n", start)
+            if nl < 0:
+                break
+            if self._skipping:
+                self._skipping = False
+            else:
+                cfg = parse_config_line(buf[start:nl].decode("utf-8", errors="replace"))
+                if cfg:
+                    yield cfg
+            start = nl + 1
+        self._tail = buf[start:]
+        if len(self._tail) > MAX_LINE_BYTES:
+            self._tail = b""
+            self._skipping = True
+
+    def close(self) -> Iterator[str]:
+        tail, self._tail = self._tail, b""
+        if tail and not self._skipping:
+            cfg = parse_config_line(tail.decode("utf-8", errors="replace"))
+            if cfg:
+                yield cfg
+
+
+class _Base64Decoder:
+    def __init__(self):
+        self._pending = b""
+        self.failed = False
+
+    def feed(self, data: bytes) -> bytes:
+        if self.failed:
+            return b""
+        data = self._pending + _WHITESPACE.sub(b"", data).translate(_URLSAFE)
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        return self._decode(data[:usable])
+
+    def close(self) -> bytes:
+        pending, self._pending = self._pending, b""
+        if not pending or self.failed:
+            return b""
+        return self._decode(pending + b"=" * (-len(pending) % 4))
+
+    def _decode(self, data: bytes) -> bytes:
+        if not data:
+            return b""
+        try:
+            return binascii.a2b_base64(data)
+        except binascii.Error:
+            self.failed = True
+            return b""
+
+
+class SubscriptionParser:
+    """Incremental subscription parser fed with raw body chunks.
+
+    The first bytes decide the format: a plain list of ``scheme://`` lines or a
+    single base64 blob, which is decoded on the fly. Only a partial line and a
+    few undecoded base64 characters are buffered between chunks. Input past
+    ``max_bytes`` is ignored and the cut-off last line dropped (``truncated``
+    is set).
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.truncated = False
+        self.is_base64: Optional[bool] = None
+        self._sniff = b""
+        self._lines = _LineSplitter()
+        self._base64 = _Base64Decoder()
+
+    def feed(self, chunk: bytes) -> Iterator[str]:
+        if self.truncated or not chunk:
+            return
+        if self.max_bytes is not None and self.bytes_read + len(chunk) > self.max_bytes:
+            chunk = chunk[:self.max_bytes - self.bytes_read]
+            self.truncated = True
+        self.bytes_read += len(chunk)
+        if self.is_base64 is None:
+            self._sniff += chunk
+            if len(self._sniff.lstrip()) < SNIFF_BYTES and not self.truncated:
+                return
+            chunk, self._sniff = self._sniff, b""
+            self._detect(chunk)
+        yield from self._consume(chunk)
+
+    def close(self) -> Iterator[str]:
+        if self.is_base64 is None:
+            chunk, self._sniff = self._sniff, b""
+            self._detect(chunk)
+            yield from self._consume(chunk)
+        if self.truncated:
+            return
+        if self.is_base64:
+            yield from self._lines.feed(self._base64.close())
+        yield from self._lines.close()
+
+    def _detect(self, head: bytes) -> None:
+        head = head.lstrip()[:SNIFF_BYTES]
+        self.is_base64 = bool(head) and b"://" not in head and _BASE64_BODY.match(head) is not None
+
+    def _consume(self, chunk: bytes) -> Iterator[str]:
+        if self.is_base64:
+            chunk = self._base64.feed(chunk)
+        if chunk:
+            yield from self._lines.feed(chunk)
+
+
+def iter_configs(chunks: Iterable[bytes], max_bytes: Optional[int] = None) -> Iterator[str]:
+    parser = SubscriptionParser(max_bytes)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+        if parser.truncated:
+            break
+    yield from parser.close()
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from probe_pool import ProbePool
+
+
+async def collect(pool: ProbePool, endpoints) -> list:
+    results = []
+    async for batch in pool.sweep(endpoints):
+        results.extend(batch)
+    return results
+
+
+class ProbePoolWorkerDeathTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.endpoints = [("127.0.0.1", port)] * 8
+        self.pool = ProbePool(2, concurrency=4, timeout=1.0)
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_sweep_after_worker_killed_completes(self):
+        self.assertEqual(len(await collect(self.pool, self.endpoints)), 8)
+        self.pool._workers[1].process.kill()
+        # Started right away: the worker may not be reaped yet, but the sweep must still end.
+        await asyncio.wait_for(collect(self.pool, self.endpoints), 10)
+        await asyncio.wait_for(self.pool._workers[1].reader, 10)
+        results = await asyncio.wait_for(collect(self.pool, self.endpoints), 10)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(value is not None for _, _, value in results))
+
+    async def test_sweep_after_reader_eof_before_reap(self):
+        await collect(self.pool, self.endpoints)
+        worker = self.pool._workers[1]
+        worker.process.kill()
+        await asyncio.wait_for(worker.reader, 10)
+        # The reader saw EOF but the exit status is not known yet.
+        with mock.patch.object(worker.process._transport, "get_returncode", return_value=None):
+            results = await asyncio.wait_for(collect(self.pool, self.endpoints), 10)
+        self.assertEqual(len(results), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()